@@ -1,29 +1,28 @@
 import os
 import io
 import time
-import math # <-- IMPORTED FOR HAVERSINE CALCULATION
-import torch
-import torch.nn as nn
-import numpy as np
-from PIL import Image, UnidentifiedImageError
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from torchvision import models, transforms
-from flask import Flask, request, jsonify, render_template
+import tempfile
+from PIL import UnidentifiedImageError
+from flask import Flask, request, jsonify, render_template, send_file, redirect
 from flask_cors import CORS
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 import json
-from PIL import Image as PILImage, UnidentifiedImageError
-import base64
-import gdown
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from inference import CLASS_LABELS, InferenceEngine
+from backends import load_backend
+from prediction_cache import PredictionCache, DiskCacheBackend, BoundedDiskStore, PredictionSessions, cache_key
+from http_cache import IMMUTABLE_CACHE_CONTROL, PrecomputedResponse, etag_matches
+from provision_model import read_recorded_checksum
+from charts import ChartStore, CHART_MEDIA_TYPES, encode_chart_id, chart_etag
+from concurrency import ExecutorBusy
+from pdf_jobs import ReportJobs, payload_key
+from report_pdf import build_report
+from site_catalogue import CatalogueSource
+from era_index import EraIndex
+from batch_predict import NDJSON_MEDIA_TYPE, expand_uploads, stream_ndjson
+from radiocarbon import CalibrationCurve, age_bp as c14_age_bp, date_batch
+import metrics
+from metrics import STAGE_SECONDS, ERRORS, IN_FLIGHT
 
 # ------------------------------
 # Flask Setup
@@ -32,35 +31,10 @@ app = Flask(__name__, template_folder='templates', static_folder='static')
 CORS(app)
 app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25MB
 
-# ------------------------------
-# Haversine Distance Function
-# ------------------------------
-def haversine(lat1, lon1, lat2, lon2):
-    """
-    Calculate the great-circle distance between two points
-    on the earth (specified in decimal degrees) in kilometers.
-    """
-    # convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
-
-    # haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371 # Radius of earth in kilometers.
-    return c * r
-
 # ------------------------------
 # Model Settings & Data
 # ------------------------------
-IMG_SIZE = 224
-NUM_CLASSES = 9
-CLASS_LABELS = [
-    "alloy", "Bead Jewellery", "Blackstone", "Kendi", "Thakli",
-    "huntingtool", "pottery", "shell bangle", "vatta_sillu"
-]
-
+# IMG_SIZE, NUM_CLASSES and CLASS_LABELS live in inference.py
 DETAILS_MAP= {
     "huntingtool": {
     "description": """This category encompasses the entire technological evolution of tools designed for the pursuit, capture, and processing of game, from the most rudimentary sharp flakes to highly specialized projectile systems. The foundational technology began with the Oldowan industry, featuring simple choppers and sharp flakes that could cut through hide and slice meat from bone. This was superseded by the iconic, symmetrical Acheulean hand-axe, a multi-purpose tool for butchering, digging, and smashing bone marrow. The Middle Paleolithic witnessed a shift towards prepared-core techniques, producing specialized points, scrapers, and knives. The Upper Paleolithic revolution introduced composite technology, where microliths were inset into wooden or bone handles to create efficient barbed spears and harpoons, culminating in the invention of the atlatl and bow, which fundamentally changed the dynamics of hunting by increasing range, force, and safety.""",
@@ -196,92 +170,268 @@ REGIONAL_FINDS = [
     }
 ]
 
+# Interval index for "which eras contain this year", used by /eras_at,
+# /calculate_c14_age and the PDF report. Events stay with /timeline_eras.
+era_index = EraIndex([{key: value for key, value in era.items() if key != 'events'} for era in TIMELINE_ERAS])
+ERA_LOOKUP_MAX_YEARS = int(os.environ.get('ERA_LOOKUP_MAX_YEARS', 1000))
+
+# Batch radiocarbon dating: up to C14_BATCH_MAX samples per request, with
+# C14_MC_SAMPLES Monte Carlo draws each unless the request asks for another
+# count. C14_CALIBRATION_CURVE names a curve table (e.g. intcal20.14c) that
+# requests can calibrate against.
+C14_BATCH_MAX = int(os.environ.get('C14_BATCH_MAX', 10000))
+C14_MC_SAMPLES = int(os.environ.get('C14_MC_SAMPLES', 2000))
+C14_MC_MAX_SAMPLES = int(os.environ.get('C14_MC_MAX_SAMPLES', 20000))
+C14_CALIBRATION_CURVE = os.environ.get('C14_CALIBRATION_CURVE')
+calibration_curve = None
+if C14_CALIBRATION_CURVE:
+    try:
+        calibration_curve = CalibrationCurve.load(C14_CALIBRATION_CURVE)
+        print(f"✅ Calibration curve loaded: {len(calibration_curve.cal_bp)} points from {C14_CALIBRATION_CURVE}")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Calibration curve {C14_CALIBRATION_CURVE} not loaded: {e}")
+
+# /timeline_eras and the location-free /regional_finds are the same for every
+# visitor, so their JSON is serialized and compressed once (the site list
+# again after each catalogue reload). Browsers may reuse them for
+# REFERENCE_MAX_AGE seconds, then revalidate with the ETag.
+REFERENCE_MAX_AGE = int(os.environ.get('REFERENCE_MAX_AGE', 600))
+REFERENCE_CACHE_CONTROL = f"public, max-age={REFERENCE_MAX_AGE}"
+reference_responses = {
+    'timeline_eras': PrecomputedResponse(sorted(TIMELINE_ERAS, key=lambda x: x['start']), REFERENCE_CACHE_CONTROL),
+}
+
+def default_sites(catalogue, limit: int = None) -> list:
+    sites = catalogue.records(limit=limit)
+    for site in sites:
+        site['distance'] = "Distance not calculated"
+    return sites
+
+def precompute_default_sites(catalogue):
+    reference_responses['regional_finds'] = PrecomputedResponse(default_sites(catalogue), REFERENCE_CACHE_CONTROL)
+
+# Sites are read from SITE_CATALOGUE_PATH (GeoJSON points or a CSV with lat
+# and lon columns) when it is set, and the file is reloaded within
+# SITE_CATALOGUE_POLL_SECONDS of a change. Otherwise REGIONAL_FINDS is used.
+SITE_CATALOGUE_PATH = os.environ.get('SITE_CATALOGUE_PATH')
+SITE_CATALOGUE_POLL_SECONDS = float(os.environ.get('SITE_CATALOGUE_POLL_SECONDS', 5))
+site_catalogue = CatalogueSource(SITE_CATALOGUE_PATH, default_records=REGIONAL_FINDS,
+                                 poll_interval=SITE_CATALOGUE_POLL_SECONDS, on_load=precompute_default_sites)
+
+# PDF reports list the REPORT_SITES catalogue sites nearest Rajapalayam,
+# the location the report's site section is written for.
+REPORT_SITES = int(os.environ.get('REPORT_SITES', 10))
+REPORT_SITES_ORIGIN = (9.4519, 77.5536)
+
 # ------------------------------
-# Model Definition & Loading
+# Model Loading
 # ------------------------------
-def create_model(num_classes: int):
-    model = models.efficientnet_v2_s(weights=models.EfficientNet_V2_S_Weights.IMAGENET1K_V1)
-    in_features = model.classifier[1].in_features
-    model.classifier[1] = nn.Sequential(
-        nn.Linear(in_features, 512),
-        nn.GELU(),
-        nn.BatchNorm1d(512),
-        nn.Dropout(0.3),
-        nn.Linear(512, num_classes)
-    )
-    return model
+# MODEL_BACKEND selects PyTorch ('torch') or ONNX Runtime ('onnxruntime',
+# needs the <checkpoint>.onnx written by export_onnx.py).
+# MODEL_PRECISION=int8 serves the quantized model written by quantize.py,
+# provided its recorded top-1 agreement reaches INT8_MIN_AGREEMENT.
+# MODEL_COMPILED=0 skips the frozen graph written by compile_model.py.
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'torch')
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'fp32')
+MODEL_COMPILED = os.environ.get('MODEL_COMPILED', '1') != '0'
+INT8_MIN_AGREEMENT = float(os.environ.get('INT8_MIN_AGREEMENT', 0.98))
+ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))
+ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 0))
 
 ckpt_path = 'artifact_with_val.pth'
 
-# Download the file if it's not present
+# The checkpoint is fetched and checksummed by provision_model.py before startup
 if not os.path.exists(ckpt_path):
-    file_id = "1zZU-WBIgGWRsPkdrHI-OPteYPVSD1Pqf"  # your Drive file ID
-    url = f"https://drive.google.com/uc?id={file_id}"
-    print("📥 Downloading model from Google Drive…")
-    gdown.download(url, ckpt_path, quiet=False)
+    raise FileNotFoundError(f"'{ckpt_path}' not found. Run `python provision_model.py --output {ckpt_path}` first.")
 
 # Now load your model
-model = create_model(NUM_CLASSES)
-
-try:
-    state = torch.load(ckpt_path, map_location='cpu')
-    # Remove 'module.' prefix if it exists (common when trained with DataParallel)
-    if isinstance(state, dict) and any(k.startswith('module.') for k in state.keys()):
-        state = {k.replace('module.', ''): v for k, v in state.items()}
-
-    model.load_state_dict(state)
-    model.eval()
-    print("✅ Model loaded successfully")
-except Exception as e:
-    print(f"⚠️ Model loading failed: {e}. Using random weights for demo.")
+load_start = time.perf_counter()
+backend = load_backend(
+    ckpt_path, MODEL_BACKEND,
+    precision=MODEL_PRECISION,
+    compiled=MODEL_COMPILED,
+    min_agreement=INT8_MIN_AGREEMENT,
+    intra_op_threads=ORT_INTRA_OP_THREADS,
+    inter_op_threads=ORT_INTER_OP_THREADS,
+)
+metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - load_start)
+metrics.MODEL_INFO.set(1, backend=backend.name, checkpoint=ckpt_path,
+                       sha256=read_recorded_checksum(ckpt_path) or "unknown")
 
 # ------------------------------
-# Preprocessing & Prediction Functions
+# Prediction Functions
 # ------------------------------
-image_transforms = transforms.Compose([
-    transforms.Resize((IMG_SIZE, IMG_SIZE)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225]),
-])
-def read_image_from_bytes(image_bytes: bytes) -> PILImage.Image:
-    return PILImage.open(io.BytesIO(image_bytes)).convert('RGB')
-
-def predict_topk(image_bytes: bytes, k: int = 5):
-    img = read_image_from_bytes(image_bytes)
-    x = image_transforms(img).unsqueeze(0)
-    with torch.no_grad():
-        logits = model(x)
-        probs = torch.softmax(logits, dim=1)[0]
-        topk = min(k, probs.shape[0])
-        conf, idx = torch.topk(probs, topk)
-        return [{"class": CLASS_LABELS[i], "probability": float(c)} for c, i in zip(conf.tolist(), idx.tolist())]
-
-def create_confidence_chart(probs, filename="confidence_chart.png"):
-    plt.figure(figsize=(10, 6))
-    colors = plt.cm.Blues(np.array(probs) * 0.8 + 0.2)
-    plt.bar(range(len(CLASS_LABELS)), probs, color=colors)
-    plt.xlabel('Artifact Classes')
-    plt.ylabel('Confidence')
-    plt.title('Model Confidence for Each Artifact Class')
-    plt.xticks(range(len(CLASS_LABELS)), CLASS_LABELS, rotation=45, ha='right')
-    plt.ylim(0, 1)
-    for i, v in enumerate(probs):
-        plt.text(i, v + 0.01, f'{v:.3f}', ha='center', va='bottom', fontsize=8)
-    plt.tight_layout()
-    chart_path = os.path.join('static', filename)
-    plt.savefig(chart_path, format='png', dpi=100)
-    plt.close()
-    return chart_path
-
-def predict_all_probs(image_bytes: bytes):
-    img = read_image_from_bytes(image_bytes)
-    x = image_transforms(img).unsqueeze(0)
-    with torch.no_grad():
-        logits = model(x)
-        probs = torch.softmax(logits, dim=1)[0]
-        return probs.tolist()
-    
+# Dynamic micro-batching: concurrent /predict calls share one forward pass.
+# BATCH_MAX_SIZE=1 disables batching.
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+engine = InferenceEngine(backend, CLASS_LABELS,
+                         max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+# Repeat uploads of the same photo skip decode, inference and chart rendering.
+# Set PREDICTION_CACHE_DIR to keep entries across worker restarts; the
+# directory is kept under PREDICTION_CACHE_MAX_MB.
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+PREDICTION_CACHE_DIR = os.environ.get('PREDICTION_CACHE_DIR')
+PREDICTION_CACHE_MAX_MB = float(os.environ.get('PREDICTION_CACHE_MAX_MB', 256))
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    backend=DiskCacheBackend(PREDICTION_CACHE_DIR, int(PREDICTION_CACHE_MAX_MB * 1024 * 1024), PREDICTION_CACHE_TTL)
+    if PREDICTION_CACHE_DIR else None,
+)
+
+# /predict keeps each upload with its results, so /generate_pdf and
+# /pdf_jobs can take a prediction_id instead of the image and results.
+# They live in PREDICTION_SESSION_DIR (shared by all workers, kept under
+# PREDICTION_SESSION_MAX_MB and PREDICTION_SESSION_TTL seconds since last
+# use); set it to '' to keep PREDICTION_SESSION_SIZE per worker in memory.
+PREDICTION_SESSION_SIZE = int(os.environ.get('PREDICTION_SESSION_SIZE', 64))
+PREDICTION_SESSION_TTL = float(os.environ.get('PREDICTION_SESSION_TTL', 3600))
+PREDICTION_SESSION_DIR = os.environ.get('PREDICTION_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'artifact_predictions'))
+PREDICTION_SESSION_MAX_MB = float(os.environ.get('PREDICTION_SESSION_MAX_MB', 512))
+prediction_sessions = PredictionSessions(
+    max_entries=PREDICTION_SESSION_SIZE,
+    ttl_seconds=PREDICTION_SESSION_TTL,
+    disk=BoundedDiskStore(PREDICTION_SESSION_DIR, int(PREDICTION_SESSION_MAX_MB * 1024 * 1024), PREDICTION_SESSION_TTL)
+    if PREDICTION_SESSION_DIR else None,
+)
+
+# /predict returns every field below unless ?fields= lists the ones wanted,
+# e.g. fields=top1,top_k. Class details are also served on their own from
+# /class_details/<class>, serialized once here; details_url carries a
+# content version, so browsers may cache them for good.
+PREDICT_FIELDS = ("prediction_id", "top_k", "top1", "details", "details_url", "chart_id", "chart_url", "c14_data")
+class_details_responses = {
+    label: PrecomputedResponse(DETAILS_MAP.get(label, {"description": "No details available"}), IMMUTABLE_CACHE_CONTROL)
+    for label in CLASS_LABELS
+}
+
+def details_url(label: str) -> str:
+    return f"/class_details/{quote(label)}?v={class_details_responses[label].version}"
+
+def parse_fields(fields):
+    """The /predict fields a request asks for; raises ValueError for unknown names."""
+    if not fields:
+        return PREDICT_FIELDS
+    wanted = tuple(name.strip() for name in fields.split(',') if name.strip())
+    unknown = [name for name in wanted if name not in PREDICT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(PREDICT_FIELDS)}")
+    return wanted
+
+# /predict_batch takes any number of "images" files, or zip archives of them,
+# up to BATCH_PREDICT_MAX_ITEMS images. BATCH_PREDICT_WORKERS of them are
+# decoded at once, so their forward passes fill the micro-batcher; results
+# stream back as NDJSON, one line per image.
+BATCH_PREDICT_WORKERS = int(os.environ.get('BATCH_PREDICT_WORKERS', BATCH_MAX_SIZE))
+BATCH_PREDICT_MAX_ITEMS = int(os.environ.get('BATCH_PREDICT_MAX_ITEMS', 1000))
+BATCH_PREDICT_MAX_MB = float(os.environ.get('BATCH_PREDICT_MAX_MB', 512))
+BATCH_PREDICT_FILE_MAX_MB = float(os.environ.get('BATCH_PREDICT_FILE_MAX_MB', 25))
+batch_executor = ThreadPoolExecutor(BATCH_PREDICT_WORKERS, thread_name_prefix="predict-batch")
+
+def classify_for_batch(image_bytes: bytes) -> dict:
+    """One /predict_batch result; shares the prediction cache with /predict."""
+    image_key = cache_key(image_bytes)
+    cached = prediction_cache.get(image_key)
+    if cached is None:
+        result = engine.predict(image_bytes, k=5)
+        cached = {
+            "top_k": result["top_k"],
+            "probs": result["probs"],
+        }
+        prediction_cache.set(image_key, cached)
+    top1 = cached["top_k"][0]
+    return {
+        "top1": top1,
+        "top_k": cached["top_k"],
+        "chart_url": f"/charts/{encode_chart_id(cached['probs'])}.png",
+        "details_url": details_url(top1["class"]),
+    }
+
+# /predict only returns a chart id that packs the probabilities; the chart
+# is rendered by /charts/<chart_id>.<png|svg> on first access and cached.
+# Hot charts stay in memory; the rest go to CHART_STORE_DIR (shared by all
+# workers, set it to '' to disable), which is kept under CHART_STORE_MAX_MB
+# and CHART_STORE_MAX_AGE seconds since last use by a background sweeper.
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', 256))
+CHART_CACHE_TTL = float(os.environ.get('CHART_CACHE_TTL', 3600))
+CHART_STORE_DIR = os.environ.get('CHART_STORE_DIR', os.path.join(tempfile.gettempdir(), 'artifact_charts'))
+CHART_STORE_MAX_MB = float(os.environ.get('CHART_STORE_MAX_MB', 256))
+CHART_STORE_MAX_AGE = float(os.environ.get('CHART_STORE_MAX_AGE', 7 * 24 * 3600))
+chart_store = ChartStore(
+    CLASS_LABELS,
+    max_entries=CHART_CACHE_SIZE,
+    ttl_seconds=CHART_CACHE_TTL,
+    disk=BoundedDiskStore(CHART_STORE_DIR, int(CHART_STORE_MAX_MB * 1024 * 1024), CHART_STORE_MAX_AGE)
+    if CHART_STORE_DIR else None,
+)
+
+# PDF reports are built by REPORT_WORKERS background processes (per web
+# worker); at most REPORT_MAX_PENDING wait before new jobs get a 503.
+# Finished reports are cached by payload hash in memory and in
+# REPORT_STORE_DIR (shared by all workers, set it to '' to disable),
+# which also holds the state of unfinished jobs so every worker can
+# answer a poll; a job still unfinished after REPORT_JOB_TIMEOUT seconds
+# is reported as failed. /generate_pdf redirects to the job instead of
+# waiting for the build.
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+REPORT_MAX_PENDING = int(os.environ.get('REPORT_MAX_PENDING', 32))
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 64))
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 3600))
+REPORT_STORE_DIR = os.environ.get('REPORT_STORE_DIR', os.path.join(tempfile.gettempdir(), 'artifact_reports'))
+REPORT_STORE_MAX_MB = float(os.environ.get('REPORT_STORE_MAX_MB', 256))
+REPORT_STORE_MAX_AGE = float(os.environ.get('REPORT_STORE_MAX_AGE', 24 * 3600))
+REPORT_RETRY_AFTER = int(os.environ.get('REPORT_RETRY_AFTER', 1))
+REPORT_JOB_TIMEOUT = float(os.environ.get('REPORT_JOB_TIMEOUT', 600))
+report_jobs = ReportJobs(
+    build_report,
+    max_workers=REPORT_WORKERS,
+    max_pending=REPORT_MAX_PENDING,
+    cache_entries=REPORT_CACHE_SIZE,
+    cache_ttl=REPORT_CACHE_TTL,
+    disk=BoundedDiskStore(REPORT_STORE_DIR, int(REPORT_STORE_MAX_MB * 1024 * 1024), REPORT_STORE_MAX_AGE)
+    if REPORT_STORE_DIR else None,
+    build_timeout=REPORT_JOB_TIMEOUT,
+)
+
+def report_build_args(data: dict):
+    """
+    Arguments for build_report(), or None if the request names an unknown
+    or expired prediction_id. A prediction_id fills in the stored image
+    and results; fields sent along with it take precedence. The chart is
+    looked up here, where the chart store lives.
+    """
+    image_bytes = None
+    if data.get('prediction_id'):
+        session = prediction_sessions.get(data['prediction_id'])
+        if session is None:
+            return None
+        result, image_bytes = session
+        top_k = result["top_k"]
+        stored = {
+            "top1": top_k[0],
+            "top_k": top_k,
+            "details": DETAILS_MAP.get(top_k[0]["class"], {"description": "No details available"}),
+            "chart_url": f"/charts/{encode_chart_id(result['probs'])}.png",
+        }
+        data = {**stored, **{key: value for key, value in data.items() if value is not None}}
+
+    c14_data = data.get('c14_data')
+    if isinstance(c14_data, dict) and isinstance(c14_data.get('calendar_year'), (int, float)):
+        data = {**data, 'c14_data': {**c14_data, 'eras': era_index.eras_at(c14_data['calendar_year'])}}
+
+    chart_png = None
+    chart_url = data.get('chart_url')
+    if chart_url:
+        try:
+            chart_png = chart_store.png_for_url(chart_url)
+        except Exception as e:
+            print(f"Error adding chart: {e}")
+    sites = site_catalogue.current.nearest(*REPORT_SITES_ORIGIN, k=REPORT_SITES)
+    return data, sites, chart_png, image_bytes
+
 secret_file = "/etc/secrets/my_secret.env"
 if os.path.exists(secret_file):
     with open(secret_file) as f:
@@ -300,12 +450,64 @@ def index():
 def health():
     return "OK", 200
 
+@app.before_request
+def track_request_start():
+    if request.endpoint:
+        IN_FLIGHT.inc(endpoint=request.endpoint)
+
+@app.teardown_request
+def track_request_end(exc=None):
+    if request.endpoint:
+        IN_FLIGHT.dec(endpoint=request.endpoint)
+
+@app.route("/metrics", endpoint="metrics")
+def metrics_endpoint():
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/batching_stats")
+def batching_stats():
+    return jsonify(engine.stats())
+
+@app.route("/cache_stats")
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+@app.route("/session_stats")
+def session_stats():
+    return jsonify(prediction_sessions.stats())
+
+@app.route("/site_catalogue_stats")
+def site_catalogue_stats():
+    return jsonify(site_catalogue.stats())
+
+@app.route("/chart_stats")
+def chart_stats():
+    return jsonify(chart_store.stats())
+
+@app.route("/charts/<chart_id>.<fmt>")
+def chart(chart_id, fmt):
+    if fmt not in CHART_MEDIA_TYPES:
+        return jsonify({"error": "Unknown chart format"}), 404
+    headers = {"ETag": chart_etag(chart_id, fmt), "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if etag_matches(request.headers.get('If-None-Match'), headers["ETag"]):
+        return '', 304, headers
+    try:
+        body = chart_store.get(chart_id, fmt)
+    except ValueError:
+        return jsonify({"error": "Unknown chart"}), 404
+    return app.response_class(body, mimetype=CHART_MEDIA_TYPES[fmt], headers=headers)
+
 
 @app.route('/predict', methods=['POST', 'HEAD'])
 def predict():
     if request.method == 'HEAD':
         return '', 200
 
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
 
@@ -314,45 +516,75 @@ def predict():
         return jsonify({"error": "Empty filename"}), 400
 
     try:
-        image_bytes = file.read()
-        try:
-            read_image_from_bytes(image_bytes)
-        except UnidentifiedImageError:
-            return jsonify({"error": "Invalid image file"}), 400
-
-        print("Image successfully read")
-
-        top_k = predict_topk(image_bytes, k=5)
-        all_probs = predict_all_probs(image_bytes)
-
-        
-
-        chart_filename = f"confidence_chart_{int(time.time())}.png"
-        create_confidence_chart(all_probs, chart_filename)
+        with STAGE_SECONDS.time(stage="upload_read"):
+            image_bytes = file.read()
+        image_key = cache_key(image_bytes)
+        cached = prediction_cache.get(image_key)
+        if cached is None:
+            try:
+                result = engine.predict(image_bytes, k=5)
+            except UnidentifiedImageError:
+                ERRORS.inc(endpoint="predict", type="UnidentifiedImageError")
+                return jsonify({"error": "Invalid image file"}), 400
+
+            cached = {
+                "top_k": result["top_k"],
+                "probs": result["probs"],
+            }
+            prediction_cache.set(image_key, cached)
+        prediction_sessions.put(image_key, cached, image_bytes)
+
+        top_k = cached["top_k"]
+        chart_id = encode_chart_id(cached["probs"])
+        chart_url = f"/charts/{chart_id}.png"
 
         top1 = top_k[0]
         details = DETAILS_MAP.get(top1["class"], {"description": "No details available"})
 
         
 
-        c14_data = request.form.get('c14_data')
+        c14_data = request.form.get('c14_data') if "c14_data" in fields else None
         if c14_data:
             try:
                 c14_data = json.loads(c14_data)
             except:
                 c14_data = None
 
-        return jsonify({
-            "top_k": top_k,
-            "top1": top1,
-            "details": details,
-            "chart_url": f"/static/{chart_filename}",
-            "c14_data": c14_data
-        })
+        with STAGE_SECONDS.time(stage="serialize"):
+            response = {
+                "prediction_id": image_key,
+                "top_k": top_k,
+                "top1": top1,
+                "details": details,
+                "details_url": details_url(top1["class"]),
+                "chart_id": chart_id,
+                "chart_url": chart_url,
+                "c14_data": c14_data
+            }
+            response = jsonify({name: response[name] for name in fields})
+        return response
     except Exception as e:
+        ERRORS.inc(endpoint="predict", type=type(e).__name__)
         print("Error during prediction:", str(e))
         return jsonify({"error": f"Inference error: {str(e)}"}), 500
 
+# Streams one NDJSON line per image as it finishes (with its upload index
+# and file name, and an "error" in place of the results if it failed),
+# then a summary line.
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    # Allows larger bodies than the single-image MAX_CONTENT_LENGTH
+    request.max_content_length = int(BATCH_PREDICT_MAX_MB * 1024 * 1024)
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({"error": "No images provided"}), 400
+
+    # Uploaded files are closed once the view returns, before streaming ends
+    uploads = [(file.filename or f"image_{i}", file.read()) for i, file in enumerate(files)]
+    items = expand_uploads(uploads, BATCH_PREDICT_MAX_ITEMS, int(BATCH_PREDICT_FILE_MAX_MB * 1024 * 1024))
+    lines = stream_ndjson(items, classify_for_batch, batch_executor, 2 * BATCH_PREDICT_WORKERS)
+    return app.response_class(lines, mimetype=NDJSON_MEDIA_TYPE)
+
 @app.route('/calculate_c14_age', methods=['POST'])
 def calculate_c14_age():
     data = request.get_json()
@@ -362,47 +594,103 @@ def calculate_c14_age():
         return jsonify({"error": "Invalid C14 percentage. Must be > 0 and <= 100."}), 400
 
     try:
-        C14_CONSTANT = 8267
-        age_bp = -C14_CONSTANT * math.log(c14_percentage / 100.0)
+        age_bp = float(c14_age_bp(c14_percentage))
         calendar_year = 1950 - age_bp
 
         return jsonify({
             'age_bp': round(age_bp),
             'calendar_year': round(calendar_year),
-            'original_percentage': c14_percentage
+            'original_percentage': c14_percentage,
+            'eras': era_index.names_at(round(calendar_year))
         })
     except Exception as e:
         return jsonify({"error": f"Calculation error: {str(e)}"}), 500
 
+# Batch dating: {"c14_percentages": [...], "c14_sds": [...], "samples": n,
+# "interval": 0.95, "calibrate": false, "seed": null}; only the
+# percentages are required.
+@app.route('/calculate_c14_ages', methods=['POST'])
+def calculate_c14_ages():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('c14_percentages'), list):
+        return jsonify({"error": "c14_percentages must be a list"}), 400
+    if len(data['c14_percentages']) > C14_BATCH_MAX:
+        return jsonify({"error": f"At most {C14_BATCH_MAX} samples per request"}), 400
+    # Checked like the FastAPI model: null means the default, and
+    # booleans are not numbers here
+    samples = data.get('samples')
+    if samples is None:
+        samples = C14_MC_SAMPLES
+    elif isinstance(samples, bool) or not isinstance(samples, int) or not 1 <= samples <= C14_MC_MAX_SAMPLES:
+        return jsonify({"error": f"samples must be an integer between 1 and {C14_MC_MAX_SAMPLES}"}), 400
+    interval = data.get('interval', 0.95)
+    if isinstance(interval, bool) or not isinstance(interval, (int, float)):
+        return jsonify({"error": "interval must be a number"}), 400
+    if data.get('calibrate') and calibration_curve is None:
+        return jsonify({"error": "No calibration curve is configured"}), 400
+    curve = calibration_curve if data.get('calibrate') else None
+
+    try:
+        results = date_batch(data['c14_percentages'], data.get('c14_sds'), samples, interval, curve, data.get('seed'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "results": results,
+        "samples": samples,
+        "interval": interval,
+        "calibration_curve": os.path.basename(curve.name) if curve is not None else None,
+    })
+
+def reference_response(name):
+    status, body, headers = reference_responses[name].respond(
+        request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    return app.response_class(body, status=status, mimetype='application/json', headers=headers)
+
+# One or more ?year= values (negative for BCE)
+@app.route('/eras_at', methods=['GET'])
+def eras_at():
+    try:
+        years = [int(year) for year in request.args.getlist('year')]
+    except ValueError:
+        return jsonify({"error": "year must be an integer"}), 400
+    if not years:
+        return jsonify({"error": "No year provided"}), 400
+    if len(years) > ERA_LOOKUP_MAX_YEARS:
+        return jsonify({"error": f"At most {ERA_LOOKUP_MAX_YEARS} years per request"}), 400
+    return jsonify({"results": [{"year": year, "eras": era_index.eras_at(year)} for year in years]})
+
+@app.route('/class_details/<label>', methods=['GET'])
+def class_details(label):
+    if label not in class_details_responses:
+        return jsonify({"error": "Unknown class"}), 404
+    status, body, headers = class_details_responses[label].respond(
+        request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    return app.response_class(body, status=status, mimetype='application/json', headers=headers)
+
 @app.route('/timeline_eras', methods=['GET'])
 def get_timeline_eras():
-    sorted_eras = sorted(TIMELINE_ERAS, key=lambda x: x['start'])
-    return jsonify(sorted_eras)
+    return reference_response('timeline_eras')
 
 # --- MODIFIED: The /regional_finds route to handle location data ---
+# Optional `k` keeps only the k nearest sites and `radius_km` only those
+# within that distance of (lat, lon).
 @app.route('/regional_finds', methods=['GET'])
 def get_regional_finds():
     user_lat = request.args.get('lat', type=float)
     user_lon = request.args.get('lon', type=float)
-
-    if user_lat and user_lon:
-        sites_with_distance = []
-        for site in REGIONAL_FINDS:
-            distance = haversine(user_lat, user_lon, site['lat'], site['lon'])
-            
-            site_copy = site.copy()
-            site_copy['distance'] = f"Approx. {round(distance)} km away"
-            sites_with_distance.append(site_copy)
-        
-        sorted_sites = sorted(sites_with_distance, key=lambda item: round(haversine(user_lat, user_lon, item['lat'], item['lon'])))
-        return jsonify(sorted_sites)
+    k = request.args.get('k', type=int)
+    radius_km = request.args.get('radius_km', type=float)
+    if k is not None and k < 1:
+        return jsonify({"error": "k must be at least 1"}), 400
+    if radius_km is not None and not radius_km > 0:
+        return jsonify({"error": "radius_km must be positive"}), 400
+
+    if user_lat is not None and user_lon is not None:
+        return jsonify(site_catalogue.current.nearest(user_lat, user_lon, k=k, radius_km=radius_km))
+    elif k is None:
+        return reference_response('regional_finds')
     else:
-        default_sites = []
-        for site in REGIONAL_FINDS:
-            site_copy = site.copy()
-            site_copy['distance'] = "Distance not calculated"
-            default_sites.append(site_copy)
-        return jsonify(default_sites)
+        return jsonify(default_sites(site_catalogue.current, limit=k))
 
 @app.route('/generate_pdf', methods=['POST'])
 def generate_pdf():
@@ -411,181 +699,70 @@ def generate_pdf():
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
-
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=12,
-            spaceBefore=12
-        )
-
-        normal_style = ParagraphStyle(
-            'CustomNormal',
-            parent=styles['BodyText'],
-            fontSize=10,
-            spaceAfter=6,
-            alignment=TA_JUSTIFY
-        )
-
-        small_style = ParagraphStyle(
-            'CustomSmall',
-            parent=styles['BodyText'],
-            fontSize=9,
-            spaceAfter=4
-        )
-
-        story = []
-
-        story.append(Paragraph("Archaeological Artifact Analysis Report", title_style))
-        story.append(Spacer(1, 20))
-
-        image_data = data.get('image_data')
-        if image_data:
-            try:
-                if image_data.startswith('data:image'):
-                    image_data = image_data.split(',')[1]
-                
-                img_data = base64.b66decode(image_data)
-                
-                temp_img_path = os.path.join(app.static_folder, f"temp_artifact_{int(time.time())}.png")
-                with open(temp_img_path, 'wb') as f:
-                    f.write(img_data)
-                
-                story.append(Paragraph("Uploaded Artifact Image", heading_style))
-                story.append(Spacer(1, 10))
-                story.append(Image(temp_img_path, width=4*inch, height=3*inch))
-                story.append(Spacer(1, 20))
-
-                import atexit
-                atexit.register(lambda: os.remove(temp_img_path) if os.path.exists(temp_img_path) else None)
-                
-            except Exception as e:
-                print(f"Error processing image: {e}")
-
-        top1 = data.get('top1', {})
-        if top1:
-            story.append(Paragraph(f"Primary Identification: <b>{top1.get('class', 'Unknown')}</b>", heading_style))
-            story.append(Paragraph(f"Confidence: {top1.get('probability', 0)*100:.2f}%", normal_style))
-            story.append(Spacer(1, 10))
-
-        chart_url = data.get('chart_url', '')
-        if chart_url:
-            try:
-                chart_path = os.path.join(app.static_folder, chart_url.split('/')[-1])
-                if os.path.exists(chart_path):
-                    img = Image(chart_path, width=6*inch, height=4*inch)
-                    story.append(img)
-                    story.append(Spacer(1, 15))
-            except Exception as e:
-                print(f"Error adding chart: {e}")
-
-        details = data.get('details', {})
-        if details:
-            story.append(Paragraph("Detailed Artifact Information", heading_style))
-            
-            detail_items = [
-                ("Description", details.get('description', 'N/A')),
-                ("Historical Era", details.get('era', 'N/A')),
-                ("Material Composition", details.get('material', 'N/A')),
-                ("Cultural Significance", details.get('significance', 'N/A')),
-                ("Cultural Context", details.get('cultural_context', 'N/A')),
-                ("Technological Markers", details.get('technological_markers', 'N/A'))
-            ]
-            
-            for title, content in detail_items:
-                if content != 'N/A':
-                    story.append(Paragraph(f"<b>{title}:</b>", normal_style))
-                    story.append(Paragraph(content, small_style))
-                    story.append(Spacer(1, 8))
-
-        top_k = data.get('top_k', [])
-        if top_k:
-            story.append(PageBreak())
-            story.append(Paragraph("Complete Classification Results", heading_style))
-            
-            table_data = [['Rank', 'Artifact Type', 'Confidence']]
-            for i, prediction in enumerate(top_k, 1):
-                table_data.append([
-                    str(i),
-                    prediction.get('class', 'Unknown'),
-                    f"{prediction.get('probability', 0)*100:.2f}%"
-                ])
-            
-            table = Table(table_data, colWidths=[1*inch, 3*inch, 1.5*inch])
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 9),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            story.append(table)
-            story.append(Spacer(1, 20))
-
-        story.append(Paragraph("Archaeological Sites Near Rajapalayam, Tamil Nadu", heading_style))
-        story.append(Paragraph("Explore these significant archaeological sites in the region:", normal_style))
-        story.append(Spacer(1, 10))
-
-        for i, site in enumerate(REGIONAL_FINDS, 1):
-            story.append(Paragraph(f"<b>{i}. {site['site']}</b>", normal_style))
-            story.append(Paragraph(f"<i>Distance: {site.get('distance', 'N/A')}</i>", small_style))
-            story.append(Paragraph(f"<b>Significance:</b> {site['significance']}", small_style))
-            story.append(Paragraph(f"<b>Key Artifacts:</b> {site['key_artifacts']}", small_style))
-            story.append(Spacer(1, 12))
-
-        c14_data = data.get('c14_data')
-        if c14_data:
-            story.append(PageBreak())
-            story.append(Paragraph("Carbon-14 Dating Analysis", heading_style))
-            story.append(Paragraph(f"Original C14 Percentage: {c14_data.get('original_percentage', 'N/A')}%", normal_style))
-            story.append(Paragraph(f"Calculated Age (BP): {c14_data.get('age_bp', 'N/A')} years", normal_style))
-            story.append(Paragraph(f"Calendar Year: {c14_data.get('calendar_year', 'N/A')} CE/BCE", normal_style))
-            story.append(Spacer(1, 10))
-
-            story.append(Paragraph("Historical Context:", heading_style))
-            story.append(Paragraph("This date places your artifact within the following historical periods:", normal_style))
-
-        story.append(Spacer(1, 20))
-        story.append(Paragraph(f"Report generated on: {time.strftime('%Y-%m-%d %H:%M:%S')}", small_style))
-        story.append(Paragraph("Generated by Archaeological Artifact Identification System", small_style))
-        
-        doc.build(story)
-        
-        pdf_content = buffer.getvalue()
-        buffer.close()
-        
-        response = app.response_class(
-            response=pdf_content,
-            status=200,
-            mimetype='application/pdf'
-        )
-        response.headers['Content-Disposition'] = 'attachment; filename=artifact_report.pdf'
-        return response
-        
+        build_args = report_build_args(data)
+        if build_args is None:
+            return jsonify({"error": "Unknown or expired prediction id"}), 404
+
+        # Queued like /pdf_jobs; the client follows the redirect to the
+        # job, which answers 202 until the PDF is ready
+        job_id = payload_key(data, build_args[1])
+        report_jobs.submit(job_id, *build_args)
+        return redirect(f"/pdf_jobs/{job_id}", code=303)
+
+    except ExecutorBusy:
+        ERRORS.inc(endpoint="generate_pdf", type="ExecutorBusy")
+        response = jsonify({"error": "Report queue is full, please retry shortly"})
+        response.headers['Retry-After'] = str(REPORT_RETRY_AFTER)
+        return response, 503
     except Exception as e:
-        if 'temp_img_path' in locals() and os.path.exists(temp_img_path):
-            os.remove(temp_img_path)
-        
+        ERRORS.inc(endpoint="generate_pdf", type=type(e).__name__)
         return jsonify({"error": f"PDF generation failed: {str(e)}"}), 500
 
+@app.route('/pdf_jobs', methods=['POST'])
+def create_pdf_job():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+
+    build_args = report_build_args(data)
+    if build_args is None:
+        return jsonify({"error": "Unknown or expired prediction id"}), 404
+
+    # The site list is part of the key, so a reloaded catalogue is not
+    # answered with reports cached from the old one
+    job_id = payload_key(data, build_args[1])
+    try:
+        report_jobs.submit(job_id, *build_args)
+    except ExecutorBusy:
+        ERRORS.inc(endpoint="create_pdf_job", type="ExecutorBusy")
+        response = jsonify({"error": "Report queue is full, please retry shortly"})
+        response.headers['Retry-After'] = str(REPORT_RETRY_AFTER)
+        return response, 503
+
+    status = report_jobs.status(job_id) or {"job_id": job_id, "status": "done"}
+    status["status_url"] = f"/pdf_jobs/{job_id}"
+    return jsonify(status), 200 if status["status"] == "done" else 202
+
+@app.route('/pdf_jobs/<job_id>', methods=['GET'])
+def get_pdf_job(job_id):
+    pdf_content = report_jobs.result(job_id)
+    if pdf_content is not None:
+        return send_file(io.BytesIO(pdf_content), mimetype='application/pdf',
+                         as_attachment=True, download_name='artifact_report.pdf')
+
+    status = report_jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown or expired report job"}), 404
+    if status["status"] == "failed":
+        return jsonify(status), 500
+    response = jsonify(status)
+    response.headers['Retry-After'] = str(REPORT_RETRY_AFTER)
+    return response, 202
+
+@app.route("/pdf_jobs_stats")
+def pdf_jobs_stats():
+    return jsonify(report_jobs.stats())
+
 # ------------------------------
 # Main Execution
 # ------------------------------
@@ -1,27 +1,35 @@
 import os
-import io
 import time
-import math
-import torch
-import torch.nn as nn
-import numpy as np
-import base64
-import atexit
+import tempfile
+import asyncio
 import json
-from PIL import Image as PILImage, UnidentifiedImageError
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from torchvision import models, transforms
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from PIL import UnidentifiedImageError
 
 # FastAPI specific imports
-from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException
-from fastapi.responses import JSONResponse, FileResponse, Response
+from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, StrictInt
 from typing import List, Optional, Dict, Any
+from inference import CLASS_LABELS, InferenceEngine
+from backends import load_backend
+from prediction_cache import PredictionCache, DiskCacheBackend, BoundedDiskStore, PredictionSessions, cache_key
+from http_cache import IMMUTABLE_CACHE_CONTROL, PrecomputedResponse, etag_matches
+from concurrency import BoundedExecutor, ExecutorBusy
+from provision_model import read_recorded_checksum
+from charts import ChartStore, CHART_MEDIA_TYPES, encode_chart_id, chart_etag
+from pdf_jobs import ReportJobs, payload_key
+from report_pdf import build_report
+from site_catalogue import CatalogueSource
+from era_index import EraIndex
+from batch_predict import NDJSON_MEDIA_TYPE, expand_uploads, stream_ndjson
+from radiocarbon import CalibrationCurve, age_bp as c14_age_bp, date_batch
+import metrics
+from metrics import STAGE_SECONDS, ERRORS, IN_FLIGHT
 # ------------------------------
 # FastAPI Setup
 # ------------------------------
@@ -47,6 +55,15 @@ templates = Jinja2Templates(directory="templates")
 class C14Request(BaseModel):
     c14_percentage: float = Field(..., gt=0, le=100, description="Percentage of C14 remaining")
 
+class C14BatchRequest(BaseModel):
+    c14_percentages: List[float] = Field(..., description="Percentage of C14 remaining, one per sample")
+    c14_sds: Optional[List[float]] = Field(None, description="Standard deviation of each percentage")
+    # Strict, so JSON booleans are rejected instead of read as 0 or 1
+    samples: Optional[StrictInt] = Field(None, ge=1, description="Monte Carlo draws per sample")
+    interval: float = Field(0.95, gt=0, lt=1, description="Probability covered by the returned intervals")
+    calibrate: bool = Field(False, description="Also calibrate against the configured curve")
+    seed: Optional[StrictInt] = Field(None, ge=0, description="Seed for reproducible draws")
+
 class TopPrediction(BaseModel):
     class_name: str = Field(..., alias='class')
     probability: float
@@ -65,6 +82,7 @@ class C14Data(BaseModel):
     calendar_year: int
 
 class PDFRequestData(BaseModel):
+    prediction_id: Optional[str] = Field(None, description="Id returned by /predict; replaces image_data, top1, top_k, details and chart_url")
     image_data: Optional[str] = None
     top1: Optional[TopPrediction] = None
     chart_url: Optional[str] = None
@@ -73,27 +91,10 @@ class PDFRequestData(BaseModel):
     c14_data: Optional[C14Data] = None
 
 
-# ------------------------------
-# Haversine Distance Function (Unchanged)
-# ------------------------------
-def haversine(lat1, lon1, lat2, lon2):
-    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371
-    return c * r
-
 # ------------------------------
 # Model Settings & Data (Unchanged)
 # ------------------------------
-IMG_SIZE = 224
-NUM_CLASSES = 9
-CLASS_LABELS = [
-    "alloy", "Bead Jewellery", "Blackstone", "Kendi", "Thakli",
-    "huntingtool", "pottery", "shell bangle", "vatta_sillu"
-]
+# IMG_SIZE, NUM_CLASSES and CLASS_LABELS live in inference.py
 # DETAILS_MAP, TIMELINE_ERAS, REGIONAL_FINDS data dictionaries are unchanged...
 # --- To save space, the large data dictionaries are omitted here but should be included from your original script ---
 DETAILS_MAP= {
@@ -231,253 +232,614 @@ REGIONAL_FINDS = [
     }
 ]
 
+# Interval index for "which eras contain this year", used by /eras_at,
+# /calculate_c14_age and the PDF report. Events stay with /timeline_eras.
+era_index = EraIndex([{key: value for key, value in era.items() if key != 'events'} for era in TIMELINE_ERAS])
+ERA_LOOKUP_MAX_YEARS = int(os.environ.get('ERA_LOOKUP_MAX_YEARS', 1000))
+
+# Batch radiocarbon dating: up to C14_BATCH_MAX samples per request, with
+# C14_MC_SAMPLES Monte Carlo draws each unless the request asks for another
+# count. C14_CALIBRATION_CURVE names a curve table (e.g. intcal20.14c) that
+# requests can calibrate against.
+C14_BATCH_MAX = int(os.environ.get('C14_BATCH_MAX', 10000))
+C14_MC_SAMPLES = int(os.environ.get('C14_MC_SAMPLES', 2000))
+C14_MC_MAX_SAMPLES = int(os.environ.get('C14_MC_MAX_SAMPLES', 20000))
+C14_CALIBRATION_CURVE = os.environ.get('C14_CALIBRATION_CURVE')
+calibration_curve = None
+if C14_CALIBRATION_CURVE:
+    try:
+        calibration_curve = CalibrationCurve.load(C14_CALIBRATION_CURVE)
+        print(f"✅ Calibration curve loaded: {len(calibration_curve.cal_bp)} points from {C14_CALIBRATION_CURVE}")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Calibration curve {C14_CALIBRATION_CURVE} not loaded: {e}")
+
+# /timeline_eras and the location-free /regional_finds are the same for every
+# visitor, so their JSON is serialized and compressed once (the site list
+# again after each catalogue reload). Browsers may reuse them for
+# REFERENCE_MAX_AGE seconds, then revalidate with the ETag.
+REFERENCE_MAX_AGE = int(os.environ.get('REFERENCE_MAX_AGE', 600))
+REFERENCE_CACHE_CONTROL = f"public, max-age={REFERENCE_MAX_AGE}"
+reference_responses = {
+    'timeline_eras': PrecomputedResponse(sorted(TIMELINE_ERAS, key=lambda x: x['start']), REFERENCE_CACHE_CONTROL),
+}
+
+def default_sites(catalogue, limit: int = None) -> list:
+    sites = catalogue.records(limit=limit)
+    for site in sites:
+        site['distance'] = "Distance not calculated"
+    return sites
+
+def precompute_default_sites(catalogue):
+    reference_responses['regional_finds'] = PrecomputedResponse(default_sites(catalogue), REFERENCE_CACHE_CONTROL)
+
+# Sites are read from SITE_CATALOGUE_PATH (GeoJSON points or a CSV with lat
+# and lon columns) when it is set, and the file is reloaded within
+# SITE_CATALOGUE_POLL_SECONDS of a change. Otherwise REGIONAL_FINDS is used.
+SITE_CATALOGUE_PATH = os.environ.get('SITE_CATALOGUE_PATH')
+SITE_CATALOGUE_POLL_SECONDS = float(os.environ.get('SITE_CATALOGUE_POLL_SECONDS', 5))
+site_catalogue = CatalogueSource(SITE_CATALOGUE_PATH, default_records=REGIONAL_FINDS,
+                                 poll_interval=SITE_CATALOGUE_POLL_SECONDS, on_load=precompute_default_sites)
+
+# PDF reports list the REPORT_SITES catalogue sites nearest Rajapalayam,
+# the location the report's site section is written for.
+REPORT_SITES = int(os.environ.get('REPORT_SITES', 10))
+REPORT_SITES_ORIGIN = (9.4519, 77.5536)
+
 # ------------------------------
-# Model Definition & Loading (Unchanged)
+# Model Loading
 # ------------------------------
-def create_model(num_classes: int):
-    model = models.efficientnet_v2_s(weights=models.EfficientNet_V2_S_Weights.IMAGENET1K_V1)
-    in_features = model.classifier[1].in_features
-    model.classifier[1] = nn.Sequential(
-        nn.Linear(in_features, 512),
-        nn.GELU(),
-        nn.BatchNorm1d(512),
-        nn.Dropout(0.3),
-        nn.Linear(512, num_classes)
-    )
-    return model
+# MODEL_BACKEND selects PyTorch ('torch') or ONNX Runtime ('onnxruntime',
+# needs the <checkpoint>.onnx written by export_onnx.py).
+# MODEL_PRECISION=int8 serves the quantized model written by quantize.py,
+# provided its recorded top-1 agreement reaches INT8_MIN_AGREEMENT.
+# MODEL_COMPILED=0 skips the frozen graph written by compile_model.py.
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'torch')
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'fp32')
+MODEL_COMPILED = os.environ.get('MODEL_COMPILED', '1') != '0'
+INT8_MIN_AGREEMENT = float(os.environ.get('INT8_MIN_AGREEMENT', 0.98))
+ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))
+ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 0))
 
 ckpt_path = 'app/artifact_model_4.pth'
 if not os.path.exists(ckpt_path):
     raise FileNotFoundError(f"'{ckpt_path}' not found.")
 
-model = create_model(NUM_CLASSES)
-try:
-    state = torch.load(ckpt_path, map_location='cpu')
-    if any(k.startswith('module.') for k in state.keys()):
-        state = {k.replace('module.', ''): v for k, v in state.items()}
-    model.load_state_dict(state)
-    model.eval()
-    print("✅ Model loaded successfully")
-except Exception as e:
-    print(f"⚠️ Model loading failed: {e}. Using random weights for demo.")
+load_start = time.perf_counter()
+backend = load_backend(
+    ckpt_path, MODEL_BACKEND,
+    precision=MODEL_PRECISION,
+    compiled=MODEL_COMPILED,
+    min_agreement=INT8_MIN_AGREEMENT,
+    intra_op_threads=ORT_INTRA_OP_THREADS,
+    inter_op_threads=ORT_INTER_OP_THREADS,
+)
+metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - load_start)
+metrics.MODEL_INFO.set(1, backend=backend.name, checkpoint=ckpt_path,
+                       sha256=read_recorded_checksum(ckpt_path) or "unknown")
 
 # ------------------------------
-# Preprocessing & Prediction Functions (Unchanged, except for class name in predict_topk)
+# Prediction Functions
 # ------------------------------
-image_transforms = transforms.Compose([
-    transforms.Resize((IMG_SIZE, IMG_SIZE)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225]),
-])
-def read_image_from_bytes(image_bytes: bytes) -> PILImage.Image:
-    return PILImage.open(io.BytesIO(image_bytes)).convert('RGB')
-
-def predict_topk(image_bytes: bytes, k: int = 5):
-    img = read_image_from_bytes(image_bytes)
-    x = image_transforms(img).unsqueeze(0)
-    with torch.no_grad():
-        logits = model(x)
-        probs = torch.softmax(logits, dim=1)[0]
-        topk = min(k, probs.shape[0])
-        conf, idx = torch.topk(probs, topk)
-        # Changed "class" to "class_name" to avoid keyword conflict, will be aliased back by Pydantic
-        return [{"class": CLASS_LABELS[i], "probability": float(c)} for c, i in zip(conf.tolist(), idx.tolist())]
-
-def create_confidence_chart(probs, filename="confidence_chart.png"):
-    plt.figure(figsize=(10, 6))
-    colors = plt.cm.Blues(np.array(probs) * 0.8 + 0.2)
-    plt.bar(range(len(CLASS_LABELS)), probs, color=colors)
-    plt.xlabel('Artifact Classes')
-    plt.ylabel('Confidence')
-    plt.title('Model Confidence for Each Artifact Class')
-    plt.xticks(range(len(CLASS_LABELS)), CLASS_LABELS, rotation=45, ha='right')
-    plt.ylim(0, 1)
-    for i, v in enumerate(probs):
-        plt.text(i, v + 0.01, f'{v:.3f}', ha='center', va='bottom', fontsize=8)
-    plt.tight_layout()
-    chart_path = os.path.join('static', filename)
-    plt.savefig(chart_path, format='png', dpi=100)
-    plt.close()
-    return chart_path
-
-def predict_all_probs(image_bytes: bytes):
-    img = read_image_from_bytes(image_bytes)
-    x = image_transforms(img).unsqueeze(0)
-    with torch.no_grad():
-        logits = model(x)
-        probs = torch.softmax(logits, dim=1)[0]
-        return probs.tolist()
+# Dynamic micro-batching: concurrent /predict calls share one forward pass.
+# BATCH_MAX_SIZE=1 disables batching.
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+engine = InferenceEngine(backend, CLASS_LABELS,
+                         max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+# Repeat uploads of the same photo skip decode, inference and chart rendering.
+# Set PREDICTION_CACHE_DIR to keep entries across worker restarts; the
+# directory is kept under PREDICTION_CACHE_MAX_MB.
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+PREDICTION_CACHE_DIR = os.environ.get('PREDICTION_CACHE_DIR')
+PREDICTION_CACHE_MAX_MB = float(os.environ.get('PREDICTION_CACHE_MAX_MB', 256))
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    backend=DiskCacheBackend(PREDICTION_CACHE_DIR, int(PREDICTION_CACHE_MAX_MB * 1024 * 1024), PREDICTION_CACHE_TTL)
+    if PREDICTION_CACHE_DIR else None,
+)
+
+# /predict keeps each upload with its results, so /generate_pdf and
+# /pdf_jobs can take a prediction_id instead of the image and results.
+# They live in PREDICTION_SESSION_DIR (shared by all workers, kept under
+# PREDICTION_SESSION_MAX_MB and PREDICTION_SESSION_TTL seconds since last
+# use); set it to '' to keep PREDICTION_SESSION_SIZE per worker in memory.
+PREDICTION_SESSION_SIZE = int(os.environ.get('PREDICTION_SESSION_SIZE', 64))
+PREDICTION_SESSION_TTL = float(os.environ.get('PREDICTION_SESSION_TTL', 3600))
+PREDICTION_SESSION_DIR = os.environ.get('PREDICTION_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'artifact_predictions'))
+PREDICTION_SESSION_MAX_MB = float(os.environ.get('PREDICTION_SESSION_MAX_MB', 512))
+prediction_sessions = PredictionSessions(
+    max_entries=PREDICTION_SESSION_SIZE,
+    ttl_seconds=PREDICTION_SESSION_TTL,
+    disk=BoundedDiskStore(PREDICTION_SESSION_DIR, int(PREDICTION_SESSION_MAX_MB * 1024 * 1024), PREDICTION_SESSION_TTL)
+    if PREDICTION_SESSION_DIR else None,
+)
+
+# /predict returns every field below unless ?fields= lists the ones wanted,
+# e.g. fields=top1,top_k. Class details are also served on their own from
+# /class_details/<class>, serialized once here; details_url carries a
+# content version, so browsers may cache them for good.
+PREDICT_FIELDS = ("prediction_id", "top_k", "top1", "details", "details_url", "chart_id", "chart_url", "c14_data")
+class_details_responses = {
+    label: PrecomputedResponse(DETAILS_MAP.get(label, {"description": "No details available"}), IMMUTABLE_CACHE_CONTROL)
+    for label in CLASS_LABELS
+}
+
+def details_url(label: str) -> str:
+    return f"/class_details/{quote(label)}?v={class_details_responses[label].version}"
+
+def parse_fields(fields):
+    """The /predict fields a request asks for; raises ValueError for unknown names."""
+    if not fields:
+        return PREDICT_FIELDS
+    wanted = tuple(name.strip() for name in fields.split(',') if name.strip())
+    unknown = [name for name in wanted if name not in PREDICT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(PREDICT_FIELDS)}")
+    return wanted
+
+# /predict_batch takes any number of "images" files, or zip archives of them,
+# up to BATCH_PREDICT_MAX_ITEMS images. BATCH_PREDICT_WORKERS of them are
+# decoded at once, so their forward passes fill the micro-batcher; results
+# stream back as NDJSON, one line per image.
+BATCH_PREDICT_WORKERS = int(os.environ.get('BATCH_PREDICT_WORKERS', BATCH_MAX_SIZE))
+BATCH_PREDICT_MAX_ITEMS = int(os.environ.get('BATCH_PREDICT_MAX_ITEMS', 1000))
+BATCH_PREDICT_MAX_MB = float(os.environ.get('BATCH_PREDICT_MAX_MB', 512))
+BATCH_PREDICT_FILE_MAX_MB = float(os.environ.get('BATCH_PREDICT_FILE_MAX_MB', 25))
+batch_executor = ThreadPoolExecutor(BATCH_PREDICT_WORKERS, thread_name_prefix="predict-batch")
+
+def upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return upload.size
+    size = upload.file.seek(0, os.SEEK_END)
+    upload.file.seek(0)
+    return size
+
+def classify_for_batch(image_bytes: bytes) -> dict:
+    """One /predict_batch result; shares the prediction cache with /predict."""
+    image_key = cache_key(image_bytes)
+    cached = prediction_cache.get(image_key)
+    if cached is None:
+        result = engine.predict(image_bytes, k=5)
+        cached = {
+            "top_k": result["top_k"],
+            "probs": result["probs"],
+        }
+        prediction_cache.set(image_key, cached)
+    top1 = cached["top_k"][0]
+    return {
+        "top1": top1,
+        "top_k": cached["top_k"],
+        "chart_url": f"/charts/{encode_chart_id(cached['probs'])}.png",
+        "details_url": details_url(top1["class"]),
+    }
+
+# Decode, inference and chart rendering run on a bounded thread pool so an
+# upload never blocks the event loop. Once INFERENCE_WORKERS are busy and
+# INFERENCE_QUEUE_SIZE more are waiting, /predict answers 503 right away.
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', BATCH_MAX_SIZE))
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 2 * INFERENCE_WORKERS))
+BUSY_RETRY_AFTER = int(os.environ.get('BUSY_RETRY_AFTER', 1))
+inference_executor = BoundedExecutor(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, thread_name_prefix="inference")
+
+# /predict only returns a chart id that packs the probabilities; the chart
+# is rendered by /charts/{chart_id}.{png|svg} on first access and cached.
+# Hot charts stay in memory; the rest go to CHART_STORE_DIR (shared by all
+# workers, set it to '' to disable), which is kept under CHART_STORE_MAX_MB
+# and CHART_STORE_MAX_AGE seconds since last use by a background sweeper.
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', 256))
+CHART_CACHE_TTL = float(os.environ.get('CHART_CACHE_TTL', 3600))
+CHART_STORE_DIR = os.environ.get('CHART_STORE_DIR', os.path.join(tempfile.gettempdir(), 'artifact_charts'))
+CHART_STORE_MAX_MB = float(os.environ.get('CHART_STORE_MAX_MB', 256))
+CHART_STORE_MAX_AGE = float(os.environ.get('CHART_STORE_MAX_AGE', 7 * 24 * 3600))
+chart_store = ChartStore(
+    CLASS_LABELS,
+    max_entries=CHART_CACHE_SIZE,
+    ttl_seconds=CHART_CACHE_TTL,
+    disk=BoundedDiskStore(CHART_STORE_DIR, int(CHART_STORE_MAX_MB * 1024 * 1024), CHART_STORE_MAX_AGE)
+    if CHART_STORE_DIR else None,
+)
+
+# PDF reports are built by REPORT_WORKERS background processes (per web
+# worker); at most REPORT_MAX_PENDING wait before new jobs get a 503.
+# Finished reports are cached by payload hash in memory and in
+# REPORT_STORE_DIR (shared by all workers, set it to '' to disable),
+# which also holds the state of unfinished jobs so every worker can
+# answer a poll; a job still unfinished after REPORT_JOB_TIMEOUT seconds
+# is reported as failed. /generate_pdf redirects to the job instead of
+# waiting for the build.
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+REPORT_MAX_PENDING = int(os.environ.get('REPORT_MAX_PENDING', 32))
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 64))
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 3600))
+REPORT_STORE_DIR = os.environ.get('REPORT_STORE_DIR', os.path.join(tempfile.gettempdir(), 'artifact_reports'))
+REPORT_STORE_MAX_MB = float(os.environ.get('REPORT_STORE_MAX_MB', 256))
+REPORT_STORE_MAX_AGE = float(os.environ.get('REPORT_STORE_MAX_AGE', 24 * 3600))
+REPORT_RETRY_AFTER = int(os.environ.get('REPORT_RETRY_AFTER', 1))
+REPORT_JOB_TIMEOUT = float(os.environ.get('REPORT_JOB_TIMEOUT', 600))
+report_jobs = ReportJobs(
+    build_report,
+    max_workers=REPORT_WORKERS,
+    max_pending=REPORT_MAX_PENDING,
+    cache_entries=REPORT_CACHE_SIZE,
+    cache_ttl=REPORT_CACHE_TTL,
+    disk=BoundedDiskStore(REPORT_STORE_DIR, int(REPORT_STORE_MAX_MB * 1024 * 1024), REPORT_STORE_MAX_AGE)
+    if REPORT_STORE_DIR else None,
+    build_timeout=REPORT_JOB_TIMEOUT,
+)
+
+def report_build_args(payload: dict):
+    """
+    Arguments for build_report(), or None if the request names an unknown
+    or expired prediction_id. A prediction_id fills in the stored image
+    and results; fields sent along with it take precedence. The chart is
+    looked up here, where the chart store lives.
+    """
+    image_bytes = None
+    if payload.get('prediction_id'):
+        session = prediction_sessions.get(payload['prediction_id'])
+        if session is None:
+            return None
+        result, image_bytes = session
+        top_k = result["top_k"]
+        stored = {
+            "top1": top_k[0],
+            "top_k": top_k,
+            "details": DETAILS_MAP.get(top_k[0]["class"], {"description": "No details available"}),
+            "chart_url": f"/charts/{encode_chart_id(result['probs'])}.png",
+        }
+        payload = {**stored, **{key: value for key, value in payload.items() if value is not None}}
+
+    c14_data = payload.get('c14_data')
+    if isinstance(c14_data, dict) and isinstance(c14_data.get('calendar_year'), (int, float)):
+        payload = {**payload, 'c14_data': {**c14_data, 'eras': era_index.eras_at(c14_data['calendar_year'])}}
+
+    chart_png = None
+    if payload.get('chart_url'):
+        try:
+            chart_png = chart_store.png_for_url(payload['chart_url'])
+        except Exception as e:
+            print(f"Error adding chart: {e}")
+    sites = site_catalogue.current.nearest(*REPORT_SITES_ORIGIN, k=REPORT_SITES)
+    return payload, sites, chart_png, image_bytes
+
+async def submit_report(data: PDFRequestData):
+    """Queues the report for a request body; returns (job_id, future for the PDF bytes)."""
+    # by_alias keeps the 'class' keys the report and the payload hash use
+    payload = data.model_dump(by_alias=True)
+    # The chart may need rendering and a stored upload reading, so do it off the event loop
+    args = await inference_executor.run(report_build_args, payload)
+    if args is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired prediction id")
+    # The site list is part of the key, so a reloaded catalogue is not
+    # answered with reports cached from the old one
+    job_id = payload_key(payload, args[1])
+    return job_id, report_jobs.submit(job_id, *args)
 
 # ------------------------------
 # Routes (Converted to FastAPI)
 # ------------------------------
+@app.middleware("http")
+async def track_in_flight(request: Request, call_next):
+    # Labelled by route name, like the Flask endpoints; unknown URLs are not tracked
+    path = request.url.path
+    route = next((r for r in app.routes if getattr(r, "path_regex", None) and r.path_regex.match(path)), None)
+    if route is None:
+        return await call_next(request)
+    with IN_FLIGHT.track_inprogress(endpoint=route.name):
+        return await call_next(request)
+
 @app.get("/", include_in_schema=False)
 async def index(request: Request):
     """Serves the main HTML page."""
     return templates.TemplateResponse("index_new.html", {"request": request})
 
+@app.get("/healthz", include_in_schema=False, name="health")
+async def healthz():
+    return Response("OK", media_type="text/plain")
+
+@app.get("/metrics", include_in_schema=False, name="metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/batching_stats")
+async def batching_stats():
+    """Returns micro-batching queue depth and batch size counters."""
+    return engine.stats()
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Returns prediction cache hit/miss/eviction counters."""
+    return prediction_cache.stats()
+
+@app.get("/session_stats")
+async def session_stats():
+    """Returns counters of the stored predictions that /generate_pdf can refer to."""
+    return prediction_sessions.stats()
+
+@app.get("/site_catalogue_stats")
+async def site_catalogue_stats():
+    """Returns the loaded site catalogue's source, size and reload counters."""
+    return site_catalogue.stats()
+
+@app.get("/chart_stats")
+async def chart_stats():
+    """Returns memory and disk tier counters of the chart store."""
+    return chart_store.stats()
+
+@app.get("/charts/{chart_id}.{fmt}")
+async def chart(chart_id: str, fmt: str, request: Request):
+    """Renders the confidence chart for a chart id from /predict (PNG or lightweight SVG)."""
+    if fmt not in CHART_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown chart format")
+    headers = {"ETag": chart_etag(chart_id, fmt), "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if etag_matches(request.headers.get('if-none-match'), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        if fmt == 'svg':
+            body = chart_store.get(chart_id, fmt)
+        else:
+            body = await inference_executor.run(chart_store.get, chart_id, fmt)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown chart")
+    except ExecutorBusy:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly.",
+                            headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+    return Response(body, media_type=CHART_MEDIA_TYPES[fmt], headers=headers)
+
+@app.get("/pdf_jobs_stats")
+async def pdf_jobs_stats():
+    """Returns report pool occupancy and report cache counters."""
+    return report_jobs.stats()
+
+@app.get("/executor_stats")
+async def executor_stats():
+    """Returns inference pool occupancy and rejected request counters."""
+    return inference_executor.stats()
+
 @app.post("/predict")
 async def predict(image: UploadFile = File(..., description="Image file of the artifact"),
-                  c14_data: Optional[str] = Form(None, description="JSON string of C-14 data")):
+                  c14_data: Optional[str] = Form(None, description="JSON string of C-14 data"),
+                  fields: Optional[str] = Query(None, description="Comma-separated response fields to return")):
     """
     Accepts an image, classifies the artifact, and returns detailed information.
     """
+    try:
+        fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not image.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid image file provided.")
 
     try:
-        image_bytes = await image.read()
-        # Test if the image can be opened to catch corrupted files
-        try:
-            read_image_from_bytes(image_bytes)
-        except UnidentifiedImageError:
-            raise HTTPException(status_code=400, detail="Cannot identify image file. It may be corrupted.")
-
-        print("Image successfully read")
-
-        top_k = predict_topk(image_bytes, k=5)
-        all_probs = predict_all_probs(image_bytes)
-        
-        chart_filename = f"confidence_chart_{int(time.time())}.png"
-        create_confidence_chart(all_probs, chart_filename)
+        with STAGE_SECONDS.time(stage="upload_read"):
+            image_bytes = await image.read()
+        image_key = cache_key(image_bytes)
+        cached = prediction_cache.get(image_key)
+        if cached is None:
+            # Decode once; corrupted files surface here as UnidentifiedImageError
+            try:
+                result = await inference_executor.run(engine.predict, image_bytes, 5)
+            except UnidentifiedImageError:
+                ERRORS.inc(endpoint="predict", type="UnidentifiedImageError")
+                raise HTTPException(status_code=400, detail="Cannot identify image file. It may be corrupted.")
+            except ExecutorBusy:
+                ERRORS.inc(endpoint="predict", type="ExecutorBusy")
+                raise HTTPException(status_code=503, detail="Server is busy, please retry shortly.",
+                                    headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+            cached = {
+                "top_k": result["top_k"],
+                "probs": result["probs"],
+            }
+            prediction_cache.set(image_key, cached)
+        # Kept for /generate_pdf; written off the event loop
+        await asyncio.to_thread(prediction_sessions.put, image_key, cached, image_bytes)
+
+        top_k = cached["top_k"]
+        chart_id = encode_chart_id(cached["probs"])
+        chart_url = f"/charts/{chart_id}.png"
 
         top1 = top_k[0]
         details = DETAILS_MAP.get(top1["class"], {"description": "No details available"})
         
         parsed_c14_data = None
-        if c14_data:
+        if c14_data and "c14_data" in fields:
             try:
                 parsed_c14_data = json.loads(c14_data)
             except json.JSONDecodeError:
                 print("Warning: C-14 data was provided but was not valid JSON.")
 
-        return {
-            "top_k": top_k,
-            "top1": top1,
-            "details": details,
-            "chart_url": f"/static/{chart_filename}",
-            "c14_data": parsed_c14_data
-        }
+        with STAGE_SECONDS.time(stage="serialize"):
+            response = {
+                "prediction_id": image_key,
+                "top_k": top_k,
+                "top1": top1,
+                "details": details,
+                "details_url": details_url(top1["class"]),
+                "chart_id": chart_id,
+                "chart_url": chart_url,
+                "c14_data": parsed_c14_data
+            }
+            body = json.dumps({name: response[name] for name in fields})
+        return Response(body, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
+        ERRORS.inc(endpoint="predict", type=type(e).__name__)
         print(f"Error during prediction: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Inference error: {str(e)}")
 
 
+@app.post("/predict_batch")
+async def predict_batch(request: Request,
+                        images: List[UploadFile] = File(..., description="Images, or zip archives of images")):
+    """
+    Classifies many images in one request. Streams one NDJSON line per
+    image as it finishes (with its upload index and file name, and an
+    "error" in place of the results if it failed), then a summary line.
+    Requests over BATCH_PREDICT_MAX_MB get a 413.
+    """
+    # The declared length first, then the bytes actually received, since a
+    # chunked request declares none
+    max_bytes = int(BATCH_PREDICT_MAX_MB * 1024 * 1024)
+    declared = request.headers.get('content-length', '')
+    if (declared.isdigit() and int(declared) > max_bytes) or sum(map(upload_size, images)) > max_bytes:
+        ERRORS.inc(endpoint="predict_batch", type="RequestTooLarge")
+        raise HTTPException(status_code=413, detail=f"Batch uploads are limited to {BATCH_PREDICT_MAX_MB:g} MB")
+    # Read one at a time by the streaming thread, not all up front
+    uploads = ((image.filename or f"image_{i}", image.file.read()) for i, image in enumerate(images))
+    items = expand_uploads(uploads, BATCH_PREDICT_MAX_ITEMS, int(BATCH_PREDICT_FILE_MAX_MB * 1024 * 1024))
+    return StreamingResponse(stream_ndjson(items, classify_for_batch, batch_executor, 2 * BATCH_PREDICT_WORKERS),
+                             media_type=NDJSON_MEDIA_TYPE)
+
 @app.post("/calculate_c14_age")
 async def calculate_c14_age(data: C14Request):
     """
     Calculates the archaeological age based on C-14 percentage.
     """
     try:
-        C14_CONSTANT = 8267
-        age_bp = -C14_CONSTANT * math.log(data.c14_percentage / 100.0)
+        age_bp = float(c14_age_bp(data.c14_percentage))
         calendar_year = 1950 - age_bp
 
         return {
             'age_bp': round(age_bp),
             'calendar_year': round(calendar_year),
-            'original_percentage': data.c14_percentage
+            'original_percentage': data.c14_percentage,
+            'eras': era_index.names_at(round(calendar_year))
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Calculation error: {str(e)}")
 
+@app.post("/calculate_c14_ages")
+async def calculate_c14_ages(data: C14BatchRequest):
+    """
+    Dates a batch of samples at once, propagating each measurement's error
+    by Monte Carlo and optionally calibrating against the configured curve.
+    """
+    samples = data.samples or C14_MC_SAMPLES
+    if len(data.c14_percentages) > C14_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {C14_BATCH_MAX} samples per request")
+    if samples > C14_MC_MAX_SAMPLES:
+        raise HTTPException(status_code=400, detail=f"At most {C14_MC_MAX_SAMPLES} draws per sample")
+    if data.calibrate and calibration_curve is None:
+        raise HTTPException(status_code=400, detail="No calibration curve is configured")
+    curve = calibration_curve if data.calibrate else None
+    try:
+        results = await inference_executor.run(date_batch, data.c14_percentages, data.c14_sds,
+                                               samples, data.interval, curve, data.seed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorBusy:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly.",
+                            headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+    return {
+        "results": results,
+        "samples": samples,
+        "interval": data.interval,
+        "calibration_curve": os.path.basename(curve.name) if curve is not None else None,
+    }
+
+def reference_response(name: str, request: Request) -> Response:
+    status, body, headers = reference_responses[name].respond(
+        request.headers.get('accept-encoding'), request.headers.get('if-none-match'))
+    return Response(content=body, status_code=status, media_type="application/json", headers=headers)
+
+@app.get("/eras_at")
+async def eras_at(year: List[int] = Query(..., description="Calendar year, negative for BCE; repeat for a batch")):
+    """Returns the timeline eras containing each requested year."""
+    if len(year) > ERA_LOOKUP_MAX_YEARS:
+        raise HTTPException(status_code=400, detail=f"At most {ERA_LOOKUP_MAX_YEARS} years per request")
+    return {"results": [{"year": y, "eras": era_index.eras_at(y)} for y in year]}
+
+@app.get("/class_details/{label}")
+async def class_details(label: str, request: Request):
+    """Returns the descriptive details of one artifact class (cacheable; see details_url in /predict)."""
+    if label not in class_details_responses:
+        raise HTTPException(status_code=404, detail="Unknown class")
+    status, body, headers = class_details_responses[label].respond(
+        request.headers.get('accept-encoding'), request.headers.get('if-none-match'))
+    return Response(content=body, status_code=status, media_type="application/json", headers=headers)
+
 @app.get("/timeline_eras", response_model=List[Dict[str, Any]])
-async def get_timeline_eras():
+async def get_timeline_eras(request: Request):
     """Returns a sorted list of historical eras for timeline visualization."""
-    return sorted(TIMELINE_ERAS, key=lambda x: x['start'])
+    return reference_response('timeline_eras', request)
 
 @app.get("/regional_finds")
-async def get_regional_finds(lat: Optional[float] = None, lon: Optional[float] = None):
+async def get_regional_finds(
+    request: Request,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    k: Optional[int] = Query(None, ge=1, description="Return only the k nearest sites"),
+    radius_km: Optional[float] = Query(None, gt=0, description="Return only sites within this distance"),
+):
     """
     Returns nearby archaeological sites. If user location is provided,
-    it calculates and sorts by distance.
+    they are sorted by distance and may be limited with k and radius_km.
     """
     if lat is not None and lon is not None:
-        sites_with_distance = []
-        for site in REGIONAL_FINDS:
-            distance = haversine(lat, lon, site['lat'], site['lon'])
-            site_copy = site.copy()
-            site_copy['distance'] = f"Approx. {round(distance)} km away"
-            sites_with_distance.append(site_copy)
-        
-        # Sort by the actual numeric distance, not the formatted string
-        return sorted(sites_with_distance, key=lambda item: haversine(lat, lon, item['lat'], item['lon']))
-    else:
+        return site_catalogue.current.nearest(lat, lon, k=k, radius_km=radius_km)
+    elif k is None:
         # Return default list if no location is provided
-        default_sites = []
-        for site in REGIONAL_FINDS:
-            site_copy = site.copy()
-            site_copy['distance'] = "Distance not calculated"
-            default_sites.append(site_copy)
-        return default_sites
+        return reference_response('regional_finds', request)
+    else:
+        return default_sites(site_catalogue.current, limit=k)
 
 @app.post("/generate_pdf")
 async def generate_pdf(data: PDFRequestData):
     """
-    Generates a comprehensive PDF report from the analysis data.
+    Generates a comprehensive PDF report from the analysis data. The
+    report is queued like /pdf_jobs and the response redirects to the
+    job, which answers 202 until the PDF is ready.
     """
-    from reportlab.lib.pagesizes import letter
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.lib import colors
-    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    # ... [Your PDF styling ParagraphStyle definitions remain the same] ...
-    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=16, spaceAfter=30, alignment=TA_CENTER)
-    heading_style = ParagraphStyle('CustomHeading', parent=styles['Heading2'], fontSize=14, spaceAfter=12, spaceBefore=12)
-    normal_style = ParagraphStyle('CustomNormal', parent=styles['BodyText'], fontSize=10, spaceAfter=6, alignment=TA_JUSTIFY)
-    small_style = ParagraphStyle('CustomSmall', parent=styles['BodyText'], fontSize=9, spaceAfter=4)
-    story = []
-
-    story.append(Paragraph("Archaeological Artifact Analysis Report", title_style))
-    story.append(Spacer(1, 20))
-    
-    temp_img_path = None
     try:
-        if data.image_data:
-            if data.image_data.startswith('data:image'):
-                image_b64_data = data.image_data.split(',')[1]
-            else:
-                image_b64_data = data.image_data
-            
-            img_bytes = base64.b66decode(image_b64_data)
-            temp_img_path = os.path.join("static", f"temp_artifact_{int(time.time())}.png")
-            with open(temp_img_path, 'wb') as f:
-                f.write(img_bytes)
-            
-            story.append(Paragraph("Uploaded Artifact Image", heading_style))
-            story.append(Spacer(1, 10))
-            story.append(Image(temp_img_path, width=4*inch, height=3*inch))
-            story.append(Spacer(1, 20))
-        
-        # ... [The rest of your PDF generation logic remains largely the same] ...
-        # Use data.top1, data.details etc.
-        if data.top1:
-             story.append(Paragraph(f"Primary Identification: <b>{data.top1.class_name}</b>", heading_style))
-             story.append(Paragraph(f"Confidence: {data.top1.probability * 100:.2f}%", normal_style))
-             story.append(Spacer(1, 10))
-        # ... and so on for all other sections
-        
-        doc.build(story)
-        pdf_content = buffer.getvalue()
-        
+        job_id, _ = await submit_report(data)
+        return RedirectResponse(f"/pdf_jobs/{job_id}", status_code=303)
+    except HTTPException:
+        raise
+    except ExecutorBusy:
+        ERRORS.inc(endpoint="generate_pdf", type="ExecutorBusy")
+        raise HTTPException(status_code=503, detail="Report queue is full, please retry shortly.",
+                            headers={"Retry-After": str(REPORT_RETRY_AFTER)})
+    except Exception as e:
+        ERRORS.inc(endpoint="generate_pdf", type=type(e).__name__)
+        print(f"PDF generation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
+
+@app.post("/pdf_jobs")
+async def create_pdf_job(data: PDFRequestData):
+    """
+    Queues a PDF report and returns its job id right away. Identical
+    requests share one job, and finished reports are served from cache.
+    """
+    try:
+        job_id, _ = await submit_report(data)
+    except ExecutorBusy:
+        ERRORS.inc(endpoint="create_pdf_job", type="ExecutorBusy")
+        raise HTTPException(status_code=503, detail="Report queue is full, please retry shortly.",
+                            headers={"Retry-After": str(REPORT_RETRY_AFTER)})
+    status = report_jobs.status(job_id) or {"job_id": job_id, "status": "done"}
+    status["status_url"] = f"/pdf_jobs/{job_id}"
+    return JSONResponse(status, status_code=200 if status["status"] == "done" else 202)
+
+@app.get("/pdf_jobs/{job_id}")
+async def get_pdf_job(job_id: str):
+    """Returns the finished PDF, or the job's progress while it is still building."""
+    pdf_content = report_jobs.result(job_id)
+    if pdf_content is not None:
         return Response(
             content=pdf_content,
             media_type='application/pdf',
             headers={'Content-Disposition': 'attachment; filename=artifact_report.pdf'}
         )
-    except Exception as e:
-        print(f"PDF generation failed: {e}")
-        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
-    finally:
-        # Clean up the temporary image file
-        if temp_img_path and os.path.exists(temp_img_path):
-            os.remove(temp_img_path)
+    status = report_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired report job")
+    if status["status"] == "failed":
+        return JSONResponse(status, status_code=500)
+    return JSONResponse(status, status_code=202, headers={"Retry-After": str(REPORT_RETRY_AFTER)})
 
 
 # ------------------------------
@@ -0,0 +1,58 @@
+import torch
+import torch.nn as nn
+from torchvision import models, transforms
+
+# IMG_SIZE, NUM_CLASSES and CLASS_LABELS are defined in the torch-free
+# inference module so serving backends that skip torch can share them.
+from inference import IMG_SIZE, NUM_CLASSES, CLASS_LABELS, IMAGENET_MEAN, IMAGENET_STD
+
+# ------------------------------
+# Model Definition & Loading
+# ------------------------------
+def create_model(num_classes: int, pretrained: bool = True):
+    weights = models.EfficientNet_V2_S_Weights.IMAGENET1K_V1 if pretrained else None
+    model = models.efficientnet_v2_s(weights=weights)
+    in_features = model.classifier[1].in_features
+    model.classifier[1] = nn.Sequential(
+        nn.Linear(in_features, 512),
+        nn.GELU(),
+        nn.BatchNorm1d(512),
+        nn.Dropout(0.3),
+        nn.Linear(512, num_classes)
+    )
+    return model
+
+def create_serving_model(num_classes: int):
+    """
+    Builds the architecture on the meta device: no ImageNet download and no
+    random initialisation, since load_checkpoint() supplies every tensor.
+    """
+    with torch.device('meta'):
+        return create_model(num_classes, pretrained=False)
+
+def load_checkpoint(model, ckpt_path: str):
+    try:
+        # Memory-map the zip-format checkpoint so pages are read on demand
+        # (and shared between processes) instead of copied up front.
+        state = torch.load(ckpt_path, map_location='cpu', weights_only=True, mmap=True)
+    except RuntimeError:
+        # Legacy (non-zip) checkpoints cannot be memory-mapped
+        state = torch.load(ckpt_path, map_location='cpu', weights_only=True)
+    # Remove 'module.' prefix if it exists (common when trained with DataParallel)
+    if isinstance(state, dict) and any(k.startswith('module.') for k in state.keys()):
+        state = {k.replace('module.', ''): v for k, v in state.items()}
+    # assign=True adopts the loaded tensors instead of copying into the
+    # model's own, which is required for meta-device models.
+    model.load_state_dict(state, assign=True)
+    model.eval()
+    return model
+
+# ------------------------------
+# Preprocessing
+# ------------------------------
+image_transforms = transforms.Compose([
+    transforms.Resize((IMG_SIZE, IMG_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=IMAGENET_MEAN.tolist(),
+                         std=IMAGENET_STD.tolist()),
+])
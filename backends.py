@@ -0,0 +1,96 @@
+"""
+Inference backends behind InferenceEngine.
+
+A backend is a callable that maps a float32 (N, 3, H, W) NumPy batch to
+(N, num_classes) logits. torch and onnxruntime are imported only by the
+backend that needs them, so an onnxruntime worker never loads torch.
+"""
+import os
+
+import numpy as np
+
+
+def onnx_path(ckpt_path: str) -> str:
+    return f"{os.path.splitext(ckpt_path)[0]}.onnx"
+
+
+# ------------------------------
+# PyTorch
+# ------------------------------
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model):
+        import torch
+        self._torch = torch
+        self.model = model
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        with self._torch.inference_mode():
+            return self.model(self._torch.from_numpy(batch)).numpy()
+
+
+def load_torch_model(ckpt_path: str, precision: str = 'fp32', compiled: bool = True, min_agreement: float = 0.98):
+    """
+    Picks the fastest available PyTorch model for ckpt_path: the INT8 model
+    from quantize.py when precision is 'int8', then the frozen graph from
+    compile_model.py, then the eager nn.Module.
+    """
+    from artifact_model import NUM_CLASSES, create_model, create_serving_model, load_checkpoint
+    from compile_model import load_compiled
+    from quantize import load_quantized
+
+    model = load_quantized(ckpt_path, min_agreement) if precision == 'int8' else None
+
+    if model is None and compiled:
+        model = load_compiled(ckpt_path)
+
+    if model is None:
+        try:
+            model = load_checkpoint(create_serving_model(NUM_CLASSES), ckpt_path)
+            print("✅ Model loaded successfully")
+        except Exception as e:
+            print(f"⚠️ Model loading failed: {e}. Using random weights for demo.")
+            model = create_model(NUM_CLASSES, pretrained=False).eval()
+    return model
+
+
+# ------------------------------
+# ONNX Runtime
+# ------------------------------
+class OnnxRuntimeBackend:
+    name = "onnxruntime"
+
+    def __init__(self, model_path: str, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        # 0 lets ONNX Runtime pick the thread count from the available cores
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+# ------------------------------
+# Backend Selection
+# ------------------------------
+BACKENDS = ('torch', 'onnxruntime')
+
+def load_backend(ckpt_path: str, name: str = 'torch', precision: str = 'fp32', compiled: bool = True,
+                 min_agreement: float = 0.98, intra_op_threads: int = 0, inter_op_threads: int = 0):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{name}'. Expected one of {BACKENDS}.")
+
+    if name == 'onnxruntime':
+        path = onnx_path(ckpt_path)
+        if os.path.exists(path):
+            print(f"✅ ONNX Runtime session loaded from {path}")
+            return OnnxRuntimeBackend(path, intra_op_threads, inter_op_threads)
+        print(f"⚠️ {path} not found; run export_onnx.py first. Falling back to PyTorch.")
+
+    return TorchBackend(load_torch_model(ckpt_path, precision, compiled, min_agreement))
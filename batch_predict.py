@@ -0,0 +1,122 @@
+"""
+Batch classification for /predict_batch.
+
+Uploads (single images or zip archives of them) are classified on a
+thread pool, several at a time, so their forward passes meet in the
+engine's MicroBatcher and run as model-sized batches. Each image's
+result is streamed as one NDJSON line as soon as it is ready; an image
+that fails produces an error line and the rest of the batch carries on.
+"""
+import io
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from PIL import UnidentifiedImageError
+
+from metrics import ERRORS
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+class BatchItemError(Exception):
+    """An upload or archive member that is skipped with a message."""
+
+
+def _zip_members(name: str, data: bytes, max_member_bytes: int):
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        yield name, BatchItemError(f"Invalid zip archive: {e}")
+        return
+    with archive:
+        for info in archive.infolist():
+            base = os.path.basename(info.filename)
+            # Folders and the metadata files macOS adds to archives
+            if info.is_dir() or not base or base.startswith('.') or info.filename.startswith('__MACOSX/'):
+                continue
+            member = f"{name}/{info.filename}"
+            if info.file_size > max_member_bytes:
+                yield member, BatchItemError(f"File is larger than {max_member_bytes // (1024 * 1024)} MB")
+                continue
+            try:
+                yield member, archive.read(info)
+            except (zipfile.BadZipFile, OSError, NotImplementedError, RuntimeError) as e:
+                yield member, BatchItemError(f"Cannot extract file: {e}")
+
+
+def expand_uploads(uploads, max_items: int, max_member_bytes: int):
+    """
+    Yields (filename, image bytes or BatchItemError) for each uploaded
+    image and for each file inside uploaded zip archives. `uploads`
+    yields (filename, bytes) and is read lazily. Stops after `max_items`.
+    """
+    count = 0
+    for name, data in uploads:
+        members = _zip_members(name, data, max_member_bytes) if data[:4] == ZIP_MAGIC else [(name, data)]
+        for item in members:
+            if count == max_items:
+                yield None, BatchItemError(f"Batch limit of {max_items} images reached; the remaining files were skipped")
+                return
+            count += 1
+            yield item
+
+
+def _line(record: dict) -> bytes:
+    return json.dumps(record).encode('utf-8') + b"\n"
+
+
+def stream_ndjson(items, classify, executor, window: int):
+    """
+    Runs classify(image_bytes) -> dict for each (filename, bytes) item on
+    `executor`, keeping at most `window` in flight, and yields one NDJSON
+    line per item in completion order, then a summary line.
+    """
+    start = time.perf_counter()
+    pending = {}
+    total = errors = 0
+
+    def finished(done):
+        nonlocal errors
+        for future in done:
+            index, name = pending.pop(future)
+            try:
+                record = {"index": index, "filename": name, **future.result()}
+            except UnidentifiedImageError:
+                ERRORS.inc(endpoint="predict_batch", type="UnidentifiedImageError")
+                record = {"index": index, "filename": name, "error": "Invalid image file"}
+            except Exception as e:
+                ERRORS.inc(endpoint="predict_batch", type=type(e).__name__)
+                record = {"index": index, "filename": name, "error": f"Inference error: {e}"}
+            errors += "error" in record
+            yield _line(record)
+
+    try:
+        for index, (name, data) in enumerate(items):
+            total += 1
+            if isinstance(data, BatchItemError):
+                errors += 1
+                yield _line({"index": index, "filename": name, "error": str(data)})
+                continue
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+            pending[executor.submit(classify, data)] = (index, name)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    finally:
+        # The client went away: drop work that has not started yet
+        for future in pending:
+            future.cancel()
+
+    seconds = time.perf_counter() - start
+    yield _line({"summary": {
+        "images": total,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "images_per_second": round(total / seconds, 2) if seconds > 0 else None,
+    }})
@@ -0,0 +1,116 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+# ------------------------------
+# Dynamic Micro-Batching
+# ------------------------------
+class MicroBatcher:
+    """
+    Collects concurrently submitted items into batches and runs them
+    through `run_batch` on a single worker thread.
+
+    A batch is closed as soon as it holds `max_batch_size` items or
+    `max_wait_ms` have passed since its first item arrived, whichever
+    comes first. `run_batch` receives a list of items and must return a
+    sequence of results in the same order; each caller's Future resolves
+    to its own slice.
+    """
+
+    def __init__(self, run_batch, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        self.requests_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self.last_batch_size = 0
+        self.batch_size_counts = Counter()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "requests_total": self.requests_total,
+            "batches_total": self.batches_total,
+            "errors_total": self.errors_total,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": self.requests_total / self.batches_total if self.batches_total else 0.0,
+            "batch_size_counts": {str(size): n for size, n in sorted(self.batch_size_counts.items())},
+        }
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a worker started in a parent
+        # process has to be restarted in each child.
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = [(item, fut) for item, fut in self._collect() if fut.set_running_or_notify_cancel()]
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        items = [item for item, _ in batch]
+        self.requests_total += len(batch)
+        self.batches_total += 1
+        self.last_batch_size = len(batch)
+        self.batch_size_counts[len(batch)] += 1
+        try:
+            results = self.run_batch(items)
+            # zip() would leave the callers past the end of a short result waiting forever
+            if len(results) != len(batch):
+                raise ValueError(f"run_batch returned {len(results)} results for {len(batch)} items")
+        except BaseException as e:
+            self.errors_total += 1
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result)
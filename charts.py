@@ -0,0 +1,224 @@
+import base64
+import io
+import re
+import threading
+from xml.sax.saxutils import escape
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image as PILImage
+
+from metrics import STAGE_SECONDS
+from prediction_cache import PredictionCache
+
+CHART_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+_CHART_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+_QUANT_MAX = 65535
+
+
+# ------------------------------
+# Chart Identifiers
+# ------------------------------
+def encode_chart_id(probs) -> str:
+    """
+    Packs a probability vector into a URL-safe chart id (each value as a
+    16-bit fraction), so any worker can render the chart from the id alone
+    without shared state. Identical predictions map to the same id.
+    """
+    quantized = np.rint(np.clip(np.asarray(probs, dtype=np.float64), 0.0, 1.0) * _QUANT_MAX)
+    return base64.urlsafe_b64encode(quantized.astype('>u2').tobytes()).rstrip(b'=').decode('ascii')
+
+
+def decode_chart_id(chart_id: str, num_classes: int) -> np.ndarray:
+    """Inverse of encode_chart_id(); raises ValueError for malformed ids."""
+    if not _CHART_ID_RE.match(chart_id):
+        raise ValueError(f"Malformed chart id: {chart_id!r}")
+    raw = base64.urlsafe_b64decode(chart_id + '=' * (-len(chart_id) % 4))
+    if len(raw) != 2 * num_classes:
+        raise ValueError(f"Chart id does not hold {num_classes} values")
+    return np.frombuffer(raw, dtype='>u2').astype(np.float64) / _QUANT_MAX
+
+
+# ------------------------------
+# SVG Chart (no matplotlib)
+# ------------------------------
+# ColorBrewer 'Blues', the anchors of matplotlib's Blues colormap
+_BLUES = np.array([
+    (247, 251, 255), (222, 235, 247), (198, 219, 239), (158, 202, 225), (107, 174, 214),
+    (66, 146, 198), (33, 113, 181), (8, 81, 156), (8, 48, 107),
+], dtype=np.float64)
+
+
+def _blues_hex(value: float) -> str:
+    anchors = np.linspace(0.0, 1.0, len(_BLUES))
+    rgb = [int(round(np.interp(value, anchors, _BLUES[:, c]))) for c in range(3)]
+    return '#%02x%02x%02x' % tuple(rgb)
+
+
+def render_confidence_svg(probs, class_labels, width: int = 1000, height: int = 600) -> bytes:
+    """
+    Lightweight SVG version of the confidence chart, written directly from
+    the values. Much smaller and cheaper than the PNG.
+    """
+    left, right, top, bottom = 70, width - 20, 40, height - 130
+    plot_w, plot_h = right - left, bottom - top
+    slot = plot_w / len(class_labels)
+    font = 'font-family="DejaVu Sans, Arial, sans-serif"'
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">',
+        f'<rect width="{width}" height="{height}" fill="white"/>',
+        f'<text x="{left + plot_w / 2:.1f}" y="{top - 14}" text-anchor="middle" font-size="14" {font}>'
+        'Model Confidence for Each Artifact Class</text>',
+    ]
+    for tick in np.linspace(0.0, 1.0, 6):
+        y = bottom - tick * plot_h
+        parts.append(f'<line x1="{left - 4}" y1="{y:.1f}" x2="{left}" y2="{y:.1f}" stroke="black"/>')
+        parts.append(f'<text x="{left - 8}" y="{y + 4:.1f}" text-anchor="end" font-size="11" {font}>{tick:.1f}</text>')
+    for i, (label, v) in enumerate(zip(class_labels, probs)):
+        v = float(v)
+        x = left + i * slot
+        bar_h = min(max(v, 0.0), 1.0) * plot_h
+        cx = x + slot / 2
+        parts.append(f'<rect x="{x + 0.1 * slot:.1f}" y="{bottom - bar_h:.1f}" width="{0.8 * slot:.1f}" '
+                     f'height="{bar_h:.1f}" fill="{_blues_hex(v * 0.8 + 0.2)}"/>')
+        parts.append(f'<text x="{cx:.1f}" y="{bottom - bar_h - 4:.1f}" text-anchor="middle" font-size="9" {font}>{v:.3f}</text>')
+        parts.append(f'<text x="{cx:.1f}" y="{bottom + 16}" text-anchor="end" font-size="11" {font} '
+                     f'transform="rotate(-45 {cx:.1f} {bottom + 16})">{escape(label)}</text>')
+    parts += [
+        f'<rect x="{left}" y="{top}" width="{plot_w}" height="{plot_h}" fill="none" stroke="black"/>',
+        f'<text x="{left + plot_w / 2:.1f}" y="{height - 12}" text-anchor="middle" font-size="12" {font}>Artifact Classes</text>',
+        f'<text x="18" y="{top + plot_h / 2:.1f}" text-anchor="middle" font-size="12" {font} '
+        f'transform="rotate(-90 18 {top + plot_h / 2:.1f})">Confidence</text>',
+        '</svg>',
+    ]
+    return "\n".join(parts).encode('utf-8')
+
+
+# ------------------------------
+# Confidence Chart Rendering
+# ------------------------------
+class ConfidenceChartRenderer:
+    """
+    Renders the per-class confidence bar chart to PNG bytes.
+
+    The figure (axes, title, class tick labels, layout) is built and drawn
+    once with the object-oriented API, so no pyplot global state is
+    involved. Each render() restores that cached background and redraws
+    only the bars and their value labels before encoding the canvas. One
+    renderer is shared per process; a lock serialises renders because a
+    Figure is not safe to mutate from several threads at once.
+    """
+
+    def __init__(self, class_labels, figsize=(10, 6), dpi: int = 100):
+        self.class_labels = list(class_labels)
+        self.dpi = dpi
+        self._cmap = colormaps['Blues']
+        self._lock = threading.Lock()
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+        positions = range(len(self.class_labels))
+        # Animated artists are skipped by canvas.draw(), so the cached
+        # background below holds everything except bars and value labels
+        self.bars = ax.bar(positions, np.zeros(len(self.class_labels)), animated=True)
+        self.labels = [ax.text(i, 0.01, '', ha='center', va='bottom', fontsize=8, animated=True)
+                       for i in positions]
+        ax.set_xlabel('Artifact Classes')
+        ax.set_ylabel('Confidence')
+        ax.set_title('Model Confidence for Each Artifact Class')
+        ax.set_xticks(positions, self.class_labels, rotation=45, ha='right')
+        ax.set_ylim(0, 1)
+        self.figure.tight_layout()
+        self.ax = ax
+
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, probs) -> bytes:
+        """Returns the chart for one probability vector as PNG bytes."""
+        probs = np.asarray(probs, dtype=float)
+        colors = self._cmap(probs * 0.8 + 0.2)
+        with self._lock:
+            self.canvas.restore_region(self._background)
+            for bar, label, v, color in zip(self.bars, self.labels, probs, colors):
+                bar.set_height(v)
+                bar.set_facecolor(color)
+                label.set_y(v + 0.01)
+                label.set_text(f'{v:.3f}')
+                self.ax.draw_artist(bar)
+                self.ax.draw_artist(label)
+            width, height = self.canvas.get_width_height()
+            img = PILImage.frombuffer('RGBA', (width, height), self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            buffer = io.BytesIO()
+            img.save(buffer, format='PNG', compress_level=1)
+        return buffer.getvalue()
+
+
+# ------------------------------
+# Lazy Chart Store
+# ------------------------------
+def chart_etag(chart_id: str, fmt: str) -> str:
+    """A chart's bytes are fixed by its id, so the id doubles as a strong ETag."""
+    return f'"{fmt}-{chart_id}"'
+
+
+class ChartStore:
+    """
+    Renders charts on first request from the probabilities packed in their
+    id, so /predict never pays for a chart nobody fetches.
+
+    Rendered bytes are kept in two tiers: a size-bounded in-memory LRU for
+    hot charts and, when `disk` (a BoundedDiskStore) is given, a shared
+    directory with content-hash file names and size/age eviction, so the
+    workers of one server reuse each other's charts.
+    """
+
+    def __init__(self, class_labels, max_entries: int = 256, ttl_seconds: float = 3600, disk=None):
+        self.class_labels = list(class_labels)
+        self.renderer = ConfidenceChartRenderer(self.class_labels)
+        self.cache = PredictionCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.disk = disk
+
+    def get(self, chart_id: str, fmt: str = 'png') -> bytes:
+        """Returns the chart bytes; raises ValueError for unknown formats or malformed ids."""
+        if fmt not in CHART_MEDIA_TYPES:
+            raise ValueError(f"Unsupported chart format: {fmt!r}")
+        key = f"{chart_id}.{fmt}"
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+
+        probs = decode_chart_id(chart_id, len(self.class_labels))
+        body = self.disk.get(key) if self.disk is not None else None
+        if body is None:
+            with STAGE_SECONDS.time(stage="chart"):
+                if fmt == 'png':
+                    body = self.renderer.render(probs)
+                else:
+                    body = render_confidence_svg(probs, self.class_labels)
+            if self.disk is not None:
+                self.disk.set(key, body)
+        self.cache.set(key, body)
+        return body
+
+    def png_for_url(self, chart_url: str):
+        """PNG bytes for a /charts/<id>.<fmt> URL as returned by /predict, or None."""
+        path = chart_url.split('?', 1)[0].rstrip('/')
+        if '/charts/' not in path:
+            return None
+        chart_id = path.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        try:
+            return self.get(chart_id, 'png')
+        except ValueError:
+            return None
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.cache.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
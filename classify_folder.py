@@ -0,0 +1,348 @@
+"""
+Classify every image under a folder, offline, with the serving model.
+
+    python classify_folder.py ARCHIVE_DIR --output results.jsonl [--checkpoint artifact_with_val.pth]
+    python classify_folder.py ARCHIVE_DIR --output results.parquet --workers 8 --batch-size 64
+
+Images are decoded and preprocessed by a pool of worker processes, one
+batch per task, while the main process runs batched forward passes
+through the same backend the apps use (see backends.load_backend). Each
+file gets one row: its path relative to ARCHIVE_DIR, the top-1 class and
+its probability, and the full probability vector in CLASS_LABELS order,
+or an error. Rows go to a JSONL file or, with pyarrow installed, to a
+folder of Parquet part files.
+
+Progress is recorded in a journal (<output>.journal) once the rows it
+covers are on disk. Running the same command again after an interruption
+skips the files already done and discards any rows written after the
+last journal entry, so every file appears exactly once in the output.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+from backends import BACKENDS, load_backend
+from inference import CLASS_LABELS, preprocess_image, read_image_from_bytes
+
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# pyarrow is optional; without it only JSONL output is available
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def find_images(root: str, recursive: bool = True) -> list:
+    """Paths of the images under root, relative to it with '/' separators, in sorted order."""
+    found = []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.')) if recursive else []
+        relative = os.path.relpath(folder, root)
+        for name in sorted(files):
+            if name.lower().endswith(VALID_EXTENSIONS) and not name.startswith('.'):
+                found.append(name if relative == '.' else f"{relative}/{name}".replace(os.sep, '/'))
+    return found
+
+
+# ------------------------------
+# Decode Workers
+# ------------------------------
+def decode_batch(root: str, paths: list):
+    """
+    Runs in a worker process. Returns (paths, array, failures): the paths
+    that decoded, their preprocessed images stacked into one
+    (n, 3, IMG_SIZE, IMG_SIZE) array, and (path, message) for the rest.
+    """
+    decoded, arrays, failures = [], [], []
+    for path in paths:
+        try:
+            with open(os.path.join(root, path), 'rb') as f:
+                arrays.append(preprocess_image(read_image_from_bytes(f.read())))
+            decoded.append(path)
+        except UnidentifiedImageError:
+            failures.append((path, "Invalid image file"))
+        except Exception as e:
+            failures.append((path, f"{type(e).__name__}: {e}"))
+    return decoded, np.stack(arrays) if arrays else None, failures
+
+
+def decoded_batches(pool, root: str, paths: list, batch_size: int, prefetch: int):
+    """
+    Yields decode_batch() results in order, keeping at most `prefetch`
+    batches queued or decoded ahead of the consumer, so memory stays
+    bounded when the model is slower than the decoders.
+    """
+    pending = []
+    for start in range(0, len(paths), batch_size):
+        pending.append(pool.apply_async(decode_batch, (root, paths[start:start + batch_size])))
+        if len(pending) > prefetch:
+            yield pending.pop(0).get()
+    while pending:
+        yield pending.pop(0).get()
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits.astype(np.float32)
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# ------------------------------
+# Output Writers
+# ------------------------------
+# Each writer returns a position from write() once the rows so far are
+# durably on disk (None while rows are still buffered), and can cut its
+# output back to such a position with truncate().
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'ab')
+
+    def truncate(self, position):
+        size = self._file.seek(0, os.SEEK_END)
+        if position > size:
+            raise ValueError(f"{self.path} is shorter than its journal records ({size} < {position} bytes)")
+        self._file.truncate(position)
+        self._file.seek(position)
+
+    def write(self, rows: list):
+        self._file.write(b"".join(json.dumps(row).encode('utf-8') + b"\n" for row in rows))
+        return self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        position = self.flush()
+        self._file.close()
+        return position
+
+
+class ParquetWriter:
+    """Part files of `rows_per_part` rows in the folder `path`; the position is the part count."""
+
+    def __init__(self, path: str, rows_per_part: int = 50000):
+        if pa is None:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow); use a .jsonl output instead")
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.schema = pa.schema(
+            [('path', pa.string()), ('top1', pa.string()), ('probability', pa.float32()),
+             ('probs', pa.list_(pa.float32())), ('error', pa.string())],
+            metadata={'class_labels': json.dumps(CLASS_LABELS)},
+        )
+        os.makedirs(path, exist_ok=True)
+        self._parts = 0
+        self._rows = []
+
+    def _part_path(self, n: int) -> str:
+        return os.path.join(self.path, f"part-{n:05d}.parquet")
+
+    def truncate(self, position):
+        # Parts past the journal were written after the last entry; they are written again
+        for name in os.listdir(self.path):
+            if name.startswith('part-') and name.endswith('.parquet') and name[5:10].isdigit() and int(name[5:10]) >= position:
+                os.remove(os.path.join(self.path, name))
+        self._parts = position
+
+    def write(self, rows: list):
+        self._rows.extend(rows)
+        return self.flush() if len(self._rows) >= self.rows_per_part else None
+
+    def flush(self):
+        if self._rows:
+            columns = {name: [row.get(name) for row in self._rows] for name in self.schema.names}
+            table = pa.Table.from_pydict(columns, schema=self.schema)
+            tmp = self._part_path(self._parts) + '.tmp'
+            pq.write_table(table, tmp)
+            os.replace(tmp, self._part_path(self._parts))
+            self._parts += 1
+            self._rows = []
+        return self._parts
+
+    def close(self):
+        return self.flush()
+
+
+def open_writer(path: str, rows_per_part: int):
+    if path.endswith('.parquet'):
+        return ParquetWriter(path, rows_per_part)
+    if path.endswith(('.jsonl', '.ndjson')):
+        return JsonlWriter(path)
+    raise ValueError(f"unsupported output format: {path} (expected .jsonl, .ndjson or .parquet)")
+
+
+# ------------------------------
+# Resume Journal
+# ------------------------------
+class Journal:
+    """
+    Append-only record of finished files. The first line describes the
+    run; each further line holds the writer position after a set of rows
+    and the files those rows cover, and is fsynced before the next batch.
+    A line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self.done = set()
+        self.position = None
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+            entries, size = [], 0
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    entries.pop()
+                    break
+                size += len(line)
+            if entries and entries[0] != header:
+                raise ValueError(f"{path} belongs to a run with different settings "
+                                 f"(pass --restart to start over): {entries[0]}")
+            for entry in entries[1:]:
+                self.done.update(entry['files'])
+                self.position = entry['position']
+            self._file = open(path, 'r+b')
+            # Drop the incomplete line before appending
+            self._file.truncate(size)
+            self._file.seek(size)
+            if not entries:
+                self._append(header)
+        else:
+            self._file = open(path, 'wb')
+            self._append(header)
+
+    def _append(self, entry: dict):
+        self._file.write(json.dumps(entry).encode('utf-8') + b"\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, position, files: list):
+        self._append({"position": position, "files": files})
+        self.done.update(files)
+        self.position = position
+
+    def close(self):
+        self._file.close()
+
+
+# ------------------------------
+# Bulk Classification
+# ------------------------------
+def classify_folder(backend, root: str, paths: list, writer, journal: Journal,
+                    workers: int, batch_size: int, progress_seconds: float = 10.0) -> dict:
+    """Classifies `paths` under root and writes one row per file; returns throughput figures."""
+    labels = np.array(CLASS_LABELS, dtype=object)
+    unjournaled = []
+    images = errors = 0
+    start = last_report = time.perf_counter()
+
+    # spawn, not fork: the parent holds the model and torch's thread pools
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        for decoded, batch, failures in decoded_batches(pool, root, paths, batch_size, prefetch=2 * workers):
+            rows = [{"path": path, "error": message} for path, message in failures]
+            if batch is not None:
+                probs = softmax(backend(batch))
+                top = probs.argmax(axis=1)
+                rows.extend(
+                    {"path": path, "top1": label, "probability": float(p), "probs": row}
+                    for path, label, p, row in zip(decoded, labels[top].tolist(),
+                                                   probs[np.arange(len(top)), top], probs.tolist())
+                )
+            unjournaled.extend(row["path"] for row in rows)
+            position = writer.write(rows)
+            if position is not None:
+                journal.record(position, unjournaled)
+                unjournaled = []
+
+            images += len(rows)
+            errors += len(failures)
+            now = time.perf_counter()
+            if now - last_report >= progress_seconds:
+                last_report = now
+                print(f"{images}/{len(paths)} images, {errors} errors, {images / (now - start):.1f} images/s",
+                      flush=True)
+
+    journal.record(writer.close(), unjournaled)
+    seconds = time.perf_counter() - start
+    return {
+        "images": images,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "images_per_second": round(images / seconds, 2) if seconds > 0 else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder', help="Folder of images to classify")
+    parser.add_argument('--output', required=True, help="Results file: .jsonl/.ndjson, or .parquet (a folder of parts)")
+    parser.add_argument('--checkpoint', default='artifact_with_val.pth')
+    parser.add_argument('--backend', default='torch', choices=BACKENDS)
+    parser.add_argument('--precision', default='fp32', choices=['fp32', 'int8'])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Decode processes (default: one less than the CPU count)")
+    parser.add_argument('--threads', type=int, default=0, help="Intra-op threads for the onnxruntime backend")
+    parser.add_argument('--no-recursive', action='store_true', help="Only classify the top level of the folder")
+    parser.add_argument('--rows-per-part', type=int, default=50000, help="Rows per Parquet part file")
+    parser.add_argument('--journal', help="Resume journal (default: <output>.journal)")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing journal and overwrite the output")
+    parser.add_argument('--progress-seconds', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        sys.exit(f"❌ {args.folder} is not a folder")
+    if args.batch_size < 1 or args.workers < 1:
+        sys.exit("❌ --batch-size and --workers must be at least 1")
+    journal_path = args.journal or f"{args.output.rstrip('/')}.journal"
+    if args.restart and os.path.exists(journal_path):
+        os.remove(journal_path)
+    if os.path.exists(args.output) and not os.path.exists(journal_path) and not args.restart:
+        sys.exit(f"❌ {args.output} exists without a journal; pass --restart to overwrite it")
+
+    try:
+        writer = open_writer(args.output, args.rows_per_part)
+        header = {"folder": os.path.abspath(args.folder), "checkpoint": os.path.abspath(args.checkpoint),
+                  "backend": args.backend, "precision": args.precision, "class_labels": CLASS_LABELS}
+        journal = Journal(journal_path, header)
+        writer.truncate(journal.position or 0)
+    except (RuntimeError, ValueError) as e:
+        sys.exit(f"❌ {e}")
+
+    paths = [path for path in find_images(args.folder, not args.no_recursive) if path not in journal.done]
+    if journal.done:
+        print(f"Resuming: {len(journal.done)} files already done, {len(paths)} to go")
+    else:
+        print(f"Found {len(paths)} images in {args.folder}")
+
+    backend = load_backend(args.checkpoint, args.backend, args.precision, intra_op_threads=args.threads)
+    try:
+        report = classify_folder(backend, args.folder, paths, writer, journal,
+                                 args.workers, args.batch_size, args.progress_seconds)
+    except KeyboardInterrupt:
+        sys.exit(f"⚠️ Interrupted after {len(journal.done)} files; run the same command again to resume.")
+    journal.close()
+    print(json.dumps(report, indent=2))
+    print(f"✅ Wrote {args.output}: {report['images']} images at {report['images_per_second']} images/s"
+          + (f", {report['errors']} could not be read" if report['errors'] else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Compile the artifact classifier into a frozen TorchScript graph.
+
+    python compile_model.py --checkpoint artifact_with_val.pth
+
+Traces the eager model and freezes it (folding BatchNorm into the convs),
+then saves <checkpoint>.ts.pt next to the checkpoint. The apps load that
+file directly at startup, which skips building the nn.Module and loading
+the state dict, and apply torch.jit.optimize_for_inference (oneDNN fusion)
+in-process. They fall back to eager mode when the file is missing or was
+compiled from a different checkpoint.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from artifact_model import IMG_SIZE, NUM_CLASSES, create_serving_model, load_checkpoint
+from provision_model import checkpoint_stat, file_sha256, same_checkpoint
+
+# The compiled file records the checkpoint's size and mtime next to its
+# SHA-256. A checkpoint with the same size and mtime is accepted without
+# reading it; the full hash is only computed when they differ (e.g. after
+# a copy that did not keep the mtime), or always with
+# COMPILED_MODEL_VERIFY_SHA256=1.
+VERIFY_SHA256 = os.environ.get('COMPILED_MODEL_VERIFY_SHA256', '0') == '1'
+
+
+def compiled_path(ckpt_path: str) -> str:
+    return f"{os.path.splitext(ckpt_path)[0]}.ts.pt"
+
+
+def compile_model(model, batch_size: int = 1):
+    """Traces and freezes the model; freezing folds BatchNorm into the preceding convs."""
+    example = torch.randn(batch_size, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+        return torch.jit.freeze(traced)
+
+
+def optimize(frozen):
+    """
+    Applies oneDNN fusion and weight prepacking in place. The result holds
+    prepacked weights that cannot be serialized, so this runs after loading
+    rather than before saving.
+    """
+    example = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        optimized = torch.jit.optimize_for_inference(frozen)
+        # Warm up so the profiling executor settles before the first request
+        optimized(example)
+        optimized(example)
+    return optimized
+
+
+def save_compiled(compiled, ckpt_path: str) -> str:
+    path = compiled_path(ckpt_path)
+    meta = {
+        "checkpoint_sha256": file_sha256(ckpt_path),
+        "checkpoint_stat": checkpoint_stat(ckpt_path),
+        "torch": torch.__version__,
+    }
+    torch.jit.save(compiled, path, _extra_files={"meta.json": json.dumps(meta)})
+    return path
+
+
+def load_compiled(ckpt_path: str, verify: bool = VERIFY_SHA256):
+    """
+    Returns the compiled model for ckpt_path, or None when there is no
+    compiled file or it was built from a different checkpoint. With
+    `verify`, the checkpoint is always hashed rather than matched by size
+    and mtime.
+    """
+    path = compiled_path(ckpt_path)
+    if not os.path.exists(path):
+        return None
+    extra = {"meta.json": ""}
+    try:
+        model = torch.jit.load(path, map_location='cpu', _extra_files=extra)
+    except RuntimeError as e:
+        print(f"⚠️ Could not load compiled model {path}: {e}")
+        return None
+    meta = json.loads(extra["meta.json"] or "{}")
+    if os.path.exists(ckpt_path) and not same_checkpoint(meta, ckpt_path, verify):
+        print(f"⚠️ {path} was compiled from a different checkpoint; using eager mode.")
+        return None
+    print(f"✅ Compiled model loaded from {path}")
+    return optimize(model)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkpoint', default='artifact_with_val.pth')
+    parser.add_argument('--benchmark-runs', type=int, default=10, help="Forward passes timed for eager vs compiled")
+    args = parser.parse_args(argv)
+
+    model = load_checkpoint(create_serving_model(NUM_CLASSES), args.checkpoint)
+    path = save_compiled(compile_model(model), args.checkpoint)
+    compiled = load_compiled(args.checkpoint)
+
+    x = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    with torch.inference_mode():
+        max_diff = (model(x) - compiled(x)).abs().max().item()
+        timings = {}
+        for name, m in (("eager", model), ("compiled", compiled)):
+            start = time.perf_counter()
+            for _ in range(args.benchmark_runs):
+                m(x)
+            timings[name] = 1000.0 * (time.perf_counter() - start) / args.benchmark_runs
+    print(f"Max |logit difference|: {max_diff:.2e}")
+    print(f"Latency per image: eager {timings['eager']:.1f} ms, compiled {timings['compiled']:.1f} ms")
+    print(f"✅ Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
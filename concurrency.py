@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ExecutorBusy(RuntimeError):
+    """Raised by BoundedExecutor.submit() when every slot is taken."""
+
+
+# ------------------------------
+# Bounded Executor
+# ------------------------------
+class BoundedExecutor:
+    """
+    Thread pool that admits at most `max_workers` running plus `max_queue`
+    waiting tasks. Beyond that submit() raises ExecutorBusy right away,
+    so an overloaded server can reject requests instead of queueing them
+    until they time out.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 16, thread_name_prefix: str = "bounded-executor"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        if max_queue < 0:
+            raise ValueError("max_queue must be >= 0")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.submitted_total = 0
+        self.rejected_total = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected_total += 1
+            raise ExecutorBusy(f"All {self.max_workers + self.max_queue} slots are busy")
+        with self._lock:
+            self.in_flight += 1
+            self.submitted_total += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn in the pool and awaits it without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "submitted_total": self.submitted_total,
+            "rejected_total": self.rejected_total,
+        }
@@ -0,0 +1,93 @@
+"""
+Interval index over the timeline eras: which periods contain a given
+calendar year (negative years are BCE).
+"""
+
+
+def format_year(year) -> str:
+    """-3300 -> "3300 BCE", 1526 -> "1526 CE"."""
+    return f"{-year} BCE" if year < 0 else f"{year} CE"
+
+
+class _Node:
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, center, by_start, by_end, left, right):
+        self.center = center
+        self.by_start = by_start
+        self.by_end = by_end
+        self.left = left
+        self.right = right
+
+
+# ------------------------------
+# Era Index
+# ------------------------------
+class EraIndex:
+    """
+    Centered interval tree over {"name", "start", "end", ...} dicts. Eras
+    are closed intervals, so a year on a boundary belongs to both eras
+    that meet there. A lookup visits one node per tree level and stops
+    scanning a node at its first non-matching era, so it costs
+    O(log n + k) for k results.
+    """
+
+    def __init__(self, eras):
+        self.eras = sorted(eras, key=lambda era: (era['start'], era['end']))
+        for era in self.eras:
+            if era['start'] > era['end']:
+                raise ValueError(f"era {era.get('name')!r} ends before it starts")
+        self._root = self._build(list(range(len(self.eras))))
+
+    def _build(self, positions):
+        if not positions:
+            return None
+        # Median endpoint, so each side gets at most half the eras
+        endpoints = sorted(p for i in positions for p in (self.eras[i]['start'], self.eras[i]['end']))
+        center = endpoints[len(endpoints) // 2]
+        left, right, here = [], [], []
+        for i in positions:
+            era = self.eras[i]
+            if era['end'] < center:
+                left.append(i)
+            elif era['start'] > center:
+                right.append(i)
+            else:
+                here.append(i)
+        # positions are in start order, so `here` already is too
+        by_end = sorted(here, key=lambda i: -self.eras[i]['end'])
+        return _Node(center, here, by_end, self._build(left), self._build(right))
+
+    def __len__(self):
+        return len(self.eras)
+
+    def positions_at(self, year) -> list:
+        """Positions in self.eras of the eras containing `year`, in start order."""
+        found = []
+        node = self._root
+        while node is not None:
+            if year < node.center:
+                # Every era here ends at or after the center; those starting by `year` match
+                for i in node.by_start:
+                    if self.eras[i]['start'] > year:
+                        break
+                    found.append(i)
+                node = node.left
+            elif year > node.center:
+                for i in node.by_end:
+                    if self.eras[i]['end'] < year:
+                        break
+                    found.append(i)
+                node = node.right
+            else:
+                found.extend(node.by_start)
+                break
+        found.sort()
+        return found
+
+    def eras_at(self, year) -> list:
+        """The era dicts containing `year`, in start order."""
+        return [self.eras[i] for i in self.positions_at(year)]
+
+    def names_at(self, year) -> list:
+        return [self.eras[i]['name'] for i in self.positions_at(year)]
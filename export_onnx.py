@@ -0,0 +1,86 @@
+"""
+Export the artifact classifier to ONNX for the onnxruntime backend.
+
+    python export_onnx.py --checkpoint artifact_with_val.pth [--images sample_images/]
+
+Builds the serving model with the checkpoint weights, exports it with a
+dynamic batch dimension to <checkpoint>.onnx and checks the ONNX Runtime
+logits against PyTorch. The file is removed again if the parity check
+fails, so the apps never pick up a model that disagrees with PyTorch.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+
+from artifact_model import IMG_SIZE, NUM_CLASSES, create_serving_model, load_checkpoint
+from backends import OnnxRuntimeBackend, onnx_path
+from inference import preprocess_image, read_image_from_bytes
+
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def export(model, path: str, opset: int = 17):
+    example = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    torch.onnx.export(
+        model.eval(), (example,), path,
+        input_names=['input'], output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset,
+        dynamo=False,
+    )
+
+
+def parity_check(model, backend, batch: np.ndarray) -> dict:
+    with torch.inference_mode():
+        expected = model(torch.from_numpy(batch)).numpy()
+    actual = backend(batch)
+    return {
+        "samples": len(batch),
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+        "top1_agreement": float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()),
+    }
+
+
+def load_sample_batch(folder: str, limit: int) -> np.ndarray:
+    arrays = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(VALID_EXTENSIONS):
+            with open(os.path.join(folder, name), 'rb') as f:
+                arrays.append(preprocess_image(read_image_from_bytes(f.read())))
+            if len(arrays) >= limit:
+                break
+    return np.stack(arrays)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkpoint', default='artifact_with_val.pth')
+    parser.add_argument('--images', help="Folder of sample images for the parity check (random inputs otherwise)")
+    parser.add_argument('--samples', type=int, default=8)
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--atol', type=float, default=1e-3, help="Largest tolerated logit difference")
+    args = parser.parse_args(argv)
+
+    model = load_checkpoint(create_serving_model(NUM_CLASSES), args.checkpoint)
+    path = onnx_path(args.checkpoint)
+    export(model, path, args.opset)
+
+    if args.images:
+        batch = load_sample_batch(args.images, args.samples)
+    else:
+        batch = np.random.default_rng(0).standard_normal((args.samples, 3, IMG_SIZE, IMG_SIZE), dtype=np.float32)
+    report = parity_check(model, OnnxRuntimeBackend(path), batch)
+    print(f"Parity on {report['samples']} samples: max |logit diff| {report['max_abs_diff']:.2e}, "
+          f"top-1 agreement {report['top1_agreement']:.1%}")
+
+    if report["max_abs_diff"] > args.atol or report["top1_agreement"] < 1.0:
+        os.remove(path)
+        sys.exit(f"❌ ONNX export does not match PyTorch within {args.atol}; {path} removed.")
+    print(f"✅ Wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Multi-worker serving with one copy of the model weights.
+
+    gunicorn -c gunicorn.conf.py app:app                                        # Flask
+    gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker app.main:app   # FastAPI
+
+preload_app imports the app in the master, so the checkpoint is loaded and
+the backend finalized (frozen, optimized, warmed up) once, before any
+worker exists. Workers are forked from the master and share those weight
+pages copy-on-write instead of each loading its own copy. Run
+memory_report.py against the master to see how much memory each worker
+really adds. Sharing applies to the PyTorch backends; MODEL_BACKEND=onnxruntime
+falls back to loading the model in each worker.
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Concurrent requests per worker are what the micro-batcher groups together
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+pidfile = os.environ.get('GUNICORN_PIDFILE', '/tmp/gunicorn-artifacts.pid')
+# onnxruntime is not fork-safe (a worker forked after the master imported it
+# hangs on exit), so the ONNX Runtime backend keeps one session per worker.
+preload_app = os.environ.get('MODEL_BACKEND', 'torch') != 'onnxruntime'
+
+# Intra-op threads used by each worker; by default the cores are split
+# evenly between workers instead of every worker claiming all of them.
+TORCH_THREADS_PER_WORKER = int(os.environ.get(
+    'TORCH_THREADS_PER_WORKER', max(1, multiprocessing.cpu_count() // workers)))
+
+# The master must never start an OpenMP thread pool: a worker forked after
+# the master ran a multi-threaded forward pass hangs on its first
+# inference. torch reads this when the preloaded app imports it.
+if preload_app:
+    os.environ['OMP_NUM_THREADS'] = '1'
+
+
+def when_ready(server):
+    # Move everything the master allocated into the permanent generation so
+    # the workers' garbage collector never touches (and copies) those pages.
+    if preload_app:
+        gc.freeze()
+        server.log.info("Model preloaded in master %s; forking %s workers", os.getpid(), workers)
+
+
+def post_fork(server, worker):
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(TORCH_THREADS_PER_WORKER)
@@ -0,0 +1,110 @@
+"""
+HTTP caching helpers shared by the Flask and FastAPI apps.
+"""
+import gzip
+import hashlib
+import json
+
+# For content-addressed responses: the bytes behind a URL never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """
+    True when an If-None-Match header value matches etag (a quoted strong
+    ETag), so the client's cached copy is current and a 304 can be sent.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+# ------------------------------
+# Precomputed Responses
+# ------------------------------
+# brotli is optional; without it responses are offered gzip-compressed only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when a client accepts several
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+def accepted_encodings(accept_encoding) -> set:
+    """Content codings allowed by an Accept-Encoding header value."""
+    if accept_encoding is None:
+        return {'identity'}
+    allowed, refused, wildcard = set(), set(), None
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == '*':
+            wildcard = q > 0
+        elif coding:
+            (allowed if q > 0 else refused).add(coding)
+    if wildcard:
+        allowed.update(c for c in ENCODINGS if c not in refused)
+    if 'identity' not in refused and wildcard is not False:
+        allowed.add('identity')
+    return allowed
+
+
+class PrecomputedResponse:
+    """
+    A JSON body serialized and compressed once, for reference data that
+    is the same for every request. Each representation has its own strong
+    ETag derived from the body's hash; a request whose If-None-Match
+    holds any of them gets a 304.
+    """
+
+    def __init__(self, payload, cache_control: str):
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.cache_control = cache_control
+        # Changes whenever the body does; can version the URL of an immutable response
+        self.version = digest[:12]
+        self.bodies = {'identity': body}
+        compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(body, quality=11)
+        self.bodies.update((coding, data) for coding, data in compressed.items() if len(data) < len(body))
+        self.etags = {coding: f'"{digest}"' if coding == 'identity' else f'"{digest}-{coding}"'
+                      for coding in self.bodies}
+
+    def _negotiate(self, accept_encoding) -> str:
+        allowed = accepted_encodings(accept_encoding)
+        for coding in ENCODINGS:
+            if coding in self.bodies and coding in allowed:
+                return coding
+        return 'identity'
+
+    def respond(self, accept_encoding, if_none_match):
+        """(status, body, headers) for a request with these header values."""
+        coding = self._negotiate(accept_encoding)
+        headers = {"ETag": self.etags[coding], "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if any(etag_matches(if_none_match, etag) for etag in self.etags.values()):
+            return 304, b'', headers
+        if coding != 'identity':
+            headers["Content-Encoding"] = coding
+        return 200, self.bodies[coding], headers
+
+    def stats(self) -> dict:
+        return {coding: len(body) for coding, body in self.bodies.items()}
@@ -0,0 +1,118 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image as PILImage
+
+from batching import MicroBatcher
+from metrics import STAGE_SECONDS
+
+# ------------------------------
+# Model Settings
+# ------------------------------
+IMG_SIZE = 224
+NUM_CLASSES = 9
+CLASS_LABELS = [
+    "alloy", "Bead Jewellery", "Blackstone", "Kendi", "Thakli",
+    "huntingtool", "pottery", "shell bangle", "vatta_sillu"
+]
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+# ------------------------------
+# Image Decoding & Preprocessing
+# ------------------------------
+def read_image_from_bytes(image_bytes: bytes) -> PILImage.Image:
+    return PILImage.open(io.BytesIO(image_bytes)).convert('RGB')
+
+def preprocess_image(img: PILImage.Image) -> np.ndarray:
+    """
+    NumPy equivalent of artifact_model.image_transforms (Resize, ToTensor,
+    Normalize), so serving does not need torchvision. Returns a float32
+    (3, IMG_SIZE, IMG_SIZE) array.
+    """
+    img = img.resize((IMG_SIZE, IMG_SIZE), PILImage.BILINEAR)
+    x = np.asarray(img, dtype=np.float32) / 255.0
+    x = (x - IMAGENET_MEAN) / IMAGENET_STD
+    return np.ascontiguousarray(x.transpose(2, 0, 1))
+
+
+# ------------------------------
+# Single-Pass Inference Engine
+# ------------------------------
+class InferenceEngine:
+    """
+    Decodes an upload once, runs one forward pass and derives top-k,
+    the full softmax vector and the raw logits from the same tensor.
+
+    `backend` is any callable mapping a float32 (N, 3, H, W) array to
+    (N, num_classes) logits; see backends.py. With max_batch_size > 1,
+    forward passes go through a MicroBatcher so concurrent requests share
+    a single batched backend call.
+    """
+
+    def __init__(self, backend, class_labels, max_batch_size: int = 1, max_wait_ms: float = 5.0):
+        self.backend = backend
+        self.class_labels = list(class_labels)
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(self._forward_many, max_batch_size, max_wait_ms)
+
+    def preprocess(self, image_bytes: bytes) -> np.ndarray:
+        """Decodes and preprocesses an upload into a (3, H, W) array.
+
+        Raises PIL.UnidentifiedImageError for files that are not images.
+        """
+        with STAGE_SECONDS.time(stage="decode"):
+            img = read_image_from_bytes(image_bytes)
+        with STAGE_SECONDS.time(stage="transform"):
+            return preprocess_image(img)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """Runs the backend on an (N, 3, H, W) batch and returns (N, num_classes) logits."""
+        with STAGE_SECONDS.time(stage="forward"):
+            return np.asarray(self.backend(batch))
+
+    def _forward_many(self, arrays: list) -> np.ndarray:
+        return self.forward(np.stack(arrays))
+
+    def infer(self, x: np.ndarray) -> np.ndarray:
+        """Returns the logits row for a single (3, H, W) array."""
+        if self.batcher is None:
+            return self.forward(x[np.newaxis])[0]
+        return self.batcher.submit(x).result()
+
+    async def infer_async(self, x: np.ndarray) -> np.ndarray:
+        """Like infer(), but awaits the batcher instead of blocking the event loop."""
+        if self.batcher is None:
+            return self.forward(x[np.newaxis])[0]
+        return await asyncio.wrap_future(self.batcher.submit(x))
+
+    def postprocess(self, logits: np.ndarray, k: int = 5) -> dict:
+        """Turns one row of logits into the prediction payload."""
+        with STAGE_SECONDS.time(stage="postprocess"):
+            logits = logits.astype(np.float32)
+            exp = np.exp(logits - logits.max())
+            probs = exp / exp.sum()
+            idx = np.argsort(-probs, kind='stable')[:k]
+            top_k = [{"class": self.class_labels[i], "probability": float(probs[i])} for i in idx]
+        return {
+            "top_k": top_k,
+            "probs": probs.tolist(),
+            "logits": logits.tolist(),
+        }
+
+    def predict(self, image_bytes: bytes, k: int = 5) -> dict:
+        x = self.preprocess(image_bytes)
+        return self.postprocess(self.infer(x), k)
+
+    async def predict_async(self, image_bytes: bytes, k: int = 5) -> dict:
+        x = self.preprocess(image_bytes)
+        return self.postprocess(await self.infer_async(x), k)
+
+    def stats(self) -> dict:
+        stats = {"backend": getattr(self.backend, "name", type(self.backend).__name__)}
+        if self.batcher is None:
+            return {**stats, "batching": False}
+        return {**stats, "batching": True, **self.batcher.stats()}
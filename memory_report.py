@@ -0,0 +1,106 @@
+"""
+Per-worker memory of a running gunicorn server.
+
+    python memory_report.py                   # master pid from the gunicorn pidfile
+    python memory_report.py --pid 1234 --json
+
+Reads /proc/<pid>/smaps_rollup (Linux only) for the master and each of its
+workers. RSS counts shared pages in every process that maps them, so it
+overstates what an extra worker costs. USS (unique set size: private clean +
+private dirty pages) is the memory that would be freed if that worker
+exited, i.e. the real price of one more worker. PSS splits each shared page
+evenly between the processes that map it, so the PSS column adds up to the
+server's total footprint.
+"""
+import argparse
+import json
+import os
+import sys
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def read_smaps_rollup(pid: int) -> dict:
+    """Returns the smaps_rollup fields of pid in MB, plus the derived USS."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding='utf-8') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in SMAPS_FIELDS:
+                values[key] = int(rest.split()[0]) / 1024.0
+    return {
+        "rss_mb": values.get('Rss', 0.0),
+        "pss_mb": values.get('Pss', 0.0),
+        "uss_mb": values.get('Private_Clean', 0.0) + values.get('Private_Dirty', 0.0),
+        "shared_mb": values.get('Shared_Clean', 0.0) + values.get('Shared_Dirty', 0.0),
+    }
+
+
+def child_pids(pid: int) -> list:
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding='utf-8') as f:
+                # The command name may contain spaces, so split after its closing paren
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def memory_report(master_pid: int) -> dict:
+    master = read_smaps_rollup(master_pid)
+    workers = {}
+    for pid in child_pids(master_pid):
+        try:
+            workers[pid] = read_smaps_rollup(pid)
+        except OSError:
+            continue  # worker exited while we were reading
+    uss = [w["uss_mb"] for w in workers.values()]
+    return {
+        "master_pid": master_pid,
+        "master": master,
+        "workers": workers,
+        "worker_uss_mb_avg": sum(uss) / len(uss) if uss else 0.0,
+        "total_pss_mb": master["pss_mb"] + sum(w["pss_mb"] for w in workers.values()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pid', type=int, help="PID of the gunicorn master")
+    parser.add_argument('--pidfile', default=os.environ.get('GUNICORN_PIDFILE', '/tmp/gunicorn-artifacts.pid'))
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    pid = args.pid
+    if pid is None:
+        try:
+            with open(args.pidfile, encoding='utf-8') as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            sys.exit(f"❌ Could not read a PID from {args.pidfile}; pass --pid.")
+    try:
+        report = memory_report(pid)
+    except OSError as e:
+        sys.exit(f"❌ Could not read memory of process {pid}: {e}")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'process':<16}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'shared MB':>11}")
+    rows = [(f"master {pid}", report["master"])]
+    rows += [(f"worker {wpid}", mem) for wpid, mem in report["workers"].items()]
+    for name, mem in rows:
+        print(f"{name:<16}{mem['rss_mb']:>10.1f}{mem['pss_mb']:>10.1f}{mem['uss_mb']:>10.1f}{mem['shared_mb']:>11.1f}")
+    print(f"\n{len(report['workers'])} workers, {report['worker_uss_mb_avg']:.1f} MB unique per worker, "
+          f"{report['total_pss_mb']:.1f} MB total (PSS)")
+
+
+if __name__ == '__main__':
+    main()
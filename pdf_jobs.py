@@ -0,0 +1,308 @@
+"""
+Background PDF report jobs.
+
+Reports are built in a small process pool so the slow, CPU-bound ReportLab
+work never ties up a web worker. A job id is the SHA-256 of the request
+payload and the site list the report embeds, so identical requests share
+one build and, once finished, are answered from the report cache without
+rebuilding, while a reloaded site catalogue gives new reports.
+
+Job progress is tracked per web process. When a shared directory is
+configured, finished reports go there, and so does a small marker for
+each job in progress or failed, so with several gunicorn workers any of
+them can report on a job, or serve a report, that another one handles.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import context
+
+from concurrency import ExecutorBusy
+from metrics import STAGE_SECONDS, ERRORS
+from prediction_cache import PredictionCache
+
+
+def payload_key(payload: dict, *inputs) -> str:
+    """
+    Job id for a report request: the hash of the canonical JSON form of
+    the payload and of the server-side `inputs` the report is built from.
+    """
+    canonical = json.dumps([payload, *inputs], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _timed_call(fn, *args):
+    # Runs in the pool process; the build time is reported back to the
+    # web process, whose metrics registry is the one that gets scraped
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+@contextmanager
+def _main_script_hidden():
+    # spawn and forkserver children re-import the launching script as
+    # __mp_main__, which under `python app.py` would rerun the app's setup
+    # (the model load included) in every pool process. The script is
+    # hidden while a child's start-up data is taken, so a pool process
+    # only imports the modules its job needs.
+    with _launch_lock:
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main
+
+
+_launch_lock = threading.Lock()
+
+
+class _SpawnReportProcess(context.SpawnProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        with _main_script_hidden():
+            return context.SpawnProcess._Popen(process_obj)
+
+
+if hasattr(context, 'ForkServerProcess'):
+    class _ForkServerReportProcess(context.ForkServerProcess):
+        @staticmethod
+        def _Popen(process_obj):
+            with _main_script_hidden():
+                return context.ForkServerProcess._Popen(process_obj)
+
+
+def _pool_context():
+    # Pool processes come from a clean forkserver (spawn where unavailable)
+    # instead of fork(), so they inherit neither the model nor the web
+    # server's threads. report_pdf is preloaded so ReportLab is imported
+    # once in the server, not in every pool process.
+    try:
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(['report_pdf'])
+        process_class = _ForkServerReportProcess
+    except ValueError:
+        ctx = multiprocessing.get_context('spawn')
+        process_class = _SpawnReportProcess
+    ctx = type(ctx)()
+    ctx.Process = process_class
+    return ctx
+
+
+def _marker_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+class _Job:
+    __slots__ = ("future", "submitted_at", "finished_at", "error")
+
+    def __init__(self, future):
+        self.future = future
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.error = None
+
+
+# ------------------------------
+# Report Job Queue
+# ------------------------------
+class ReportJobs:
+    """
+    Runs `build_fn(*args)` (a function returning PDF bytes, defined at
+    module level in an importable module, not the main script) in a pool
+    of `max_workers` processes.
+
+    At most `max_pending` builds may be queued or running; submit() raises
+    ExecutorBusy beyond that. Finished reports are kept in an in-memory
+    LRU and, when `disk` (a BoundedDiskStore) is given, in a shared
+    directory, along with the state of unfinished and failed jobs. Failed
+    jobs are remembered for `job_ttl` seconds so their error can be
+    reported, then they may be retried. A job another worker started is
+    taken as lost once it has run for `build_timeout` seconds.
+    """
+
+    def __init__(self, build_fn, max_workers: int = 2, max_pending: int = 32,
+                 cache_entries: int = 64, cache_ttl: float = 3600, disk=None, job_ttl: float = 3600,
+                 build_timeout: float = 600):
+        self.build_fn = build_fn
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.build_timeout = build_timeout
+        self.cache = PredictionCache(max_entries=cache_entries, ttl_seconds=cache_ttl)
+        self.disk = disk
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+        self.submitted_total = 0
+        self.completed_total = 0
+        self.failed_total = 0
+        self.rejected_total = 0
+        self.cached_total = 0
+
+    def _get_pool(self):
+        # Created lazily, and again after fork(), since a pool belongs to
+        # the process that started it
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=_pool_context())
+            self._pool_pid = pid
+        return self._pool
+
+    def result(self, job_id: str):
+        """The finished report's bytes, or None if it is not available."""
+        pdf = self.cache.get(job_id)
+        if pdf is None and self.disk is not None:
+            pdf = self.disk.get(job_id)
+            if pdf is not None:
+                self.cache.set(job_id, pdf)
+        return pdf
+
+    def submit(self, job_id: str, *args) -> Future:
+        """
+        Starts building report `job_id` unless it is already finished or
+        in progress. Returns a Future for the PDF bytes.
+        """
+        pdf = self.result(job_id)
+        if pdf is not None:
+            with self._lock:
+                self.cached_total += 1
+            future = Future()
+            future.set_result(pdf)
+            return future
+
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and not job.future.done():
+                return job.future
+            if self._pending() >= self.max_pending:
+                self.rejected_total += 1
+                raise ExecutorBusy(f"{self.max_pending} reports are already queued")
+
+            try:
+                pool_future = self._get_pool().submit(_timed_call, self.build_fn, *args)
+            except BrokenProcessPool:
+                # A pool process died; replace the pool and try once more
+                self._pool = None
+                pool_future = self._get_pool().submit(_timed_call, self.build_fn, *args)
+            job = self._jobs[job_id] = _Job(Future())
+            job.future.set_running_or_notify_cancel()
+            self.submitted_total += 1
+
+        # Written before the client is sent to poll the job, which any worker may answer
+        self._share(job_id, {"status": "running", "submitted_at": job.submitted_at})
+        pool_future.add_done_callback(lambda f: self._finish(job_id, job, f))
+        return job.future
+
+    def _finish(self, job_id, job, pool_future):
+        try:
+            pdf, seconds = pool_future.result()
+        except Exception as e:
+            ERRORS.inc(endpoint="pdf_jobs", type=type(e).__name__)
+            print(f"❌ Report {job_id[:12]} failed: {e}")
+            with self._lock:
+                job.error = str(e) or type(e).__name__
+                job.finished_at = time.time()
+                self.failed_total += 1
+            self._share(job_id, {"status": "failed", "error": job.error, "finished_at": job.finished_at})
+            job.future.set_exception(e)
+            return
+
+        STAGE_SECONDS.observe(seconds, stage="pdf_build")
+        self.cache.set(job_id, pdf)
+        if self.disk is not None:
+            # The report is stored before its marker goes, so no worker sees neither
+            self.disk.set(job_id, pdf)
+            self.disk.delete(_marker_key(job_id))
+        with self._lock:
+            # From here on the report is served from the cache
+            if self._jobs.get(job_id) is job:
+                del self._jobs[job_id]
+            self.completed_total += 1
+        job.future.set_result(pdf)
+
+    def status(self, job_id: str):
+        """Progress of one job as a dict, or None for unknown ids."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.future.done():
+                now = time.time()
+                ahead = sum(1 for other in self._jobs.values()
+                            if not other.future.done() and other.submitted_at < job.submitted_at)
+                state = "queued" if ahead >= self.max_workers else "running"
+                return {
+                    "job_id": job_id,
+                    "status": state,
+                    "queue_position": max(ahead - self.max_workers + 1, 0),
+                    "elapsed_seconds": round(now - job.submitted_at, 3),
+                }
+            if job is not None and job.error is not None:
+                return {"job_id": job_id, "status": "failed", "error": job.error}
+        status = self._shared_status(job_id)
+        if status is not None:
+            return status
+        if self.result(job_id) is not None:
+            return {"job_id": job_id, "status": "done"}
+        return None
+
+    def _share(self, job_id: str, state: dict):
+        if self.disk is not None:
+            self.disk.set(_marker_key(job_id), json.dumps(state).encode('utf-8'))
+
+    def _shared_status(self, job_id: str):
+        # A job this worker does not know about, as recorded by the worker running it
+        marker = self.disk.get(_marker_key(job_id)) if self.disk is not None else None
+        if marker is None:
+            return None
+        try:
+            state = json.loads(marker)
+        except ValueError:
+            return None
+        now = time.time()
+        if state.get("status") == "failed":
+            if now - state.get("finished_at", 0) > self.job_ttl:
+                return None
+            return {"job_id": job_id, "status": "failed", "error": state.get("error")}
+        elapsed = now - state.get("submitted_at", 0)
+        if elapsed > self.build_timeout:
+            # The worker building it was most likely restarted
+            return {"job_id": job_id, "status": "failed", "error": "Report build did not finish"}
+        return {"job_id": job_id, "status": "running", "elapsed_seconds": round(elapsed, 3)}
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [k for k, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending()
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": pending,
+                "jobs": len(self._jobs),
+                "submitted_total": self.submitted_total,
+                "completed_total": self.completed_total,
+                "failed_total": self.failed_total,
+                "rejected_total": self.rejected_total,
+                "cached_total": self.cached_total,
+                "memory": self.cache.stats(),
+                "disk": self.disk.stats() if self.disk is not None else None,
+            }
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(image_bytes: bytes) -> str:
+    """Content address of an upload: identical bytes always map to the same key."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+# ------------------------------
+# On-Disk Backend
+# ------------------------------
+class DiskCacheBackend:
+    """
+    Keeps each entry as JSON in a BoundedDiskStore so cached predictions
+    survive a worker restart. The directory is held under `max_bytes`,
+    and entries unused for `max_age_seconds` (the cache TTL) are deleted
+    by the store's sweeper rather than piling up. Any object with the
+    same get/set/delete methods can be used as a backend instead.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, max_age_seconds: float = 3600):
+        self.store = BoundedDiskStore(directory, max_bytes, max_age_seconds)
+
+    def get(self, key: str):
+        """Returns (expires_at, value) or None."""
+        data = self.store.get(key)
+        if data is None:
+            return None
+        try:
+            record = json.loads(data)
+            return record["expires_at"], record["value"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def set(self, key: str, value, expires_at: float):
+        self.store.set(key, json.dumps({"expires_at": expires_at, "value": value}).encode('utf-8'))
+
+    def delete(self, key: str):
+        self.store.delete(key)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+class BoundedDiskStore:
+    """
+    Byte blobs on disk under content-hash file names, with a total size
+    and an age limit. Reads refresh a file's mtime, so age counts from
+    the last use. A background thread sweeps the directory every
+    `sweep_interval` seconds: it deletes files idle for longer than
+    `max_age_seconds`, then the least recently used ones until the
+    directory fits in `max_bytes`. Several worker processes can share
+    one directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024,
+                 max_age_seconds: float = 7 * 24 * 3600, sweep_interval: float = 60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval = sweep_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._sweeper_pid = None
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.files = 0
+        self.bytes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, key: str):
+        self._ensure_sweeper()
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes):
+        self._ensure_sweeper()
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            # Approximate until the next sweep recounts the directory
+            self.writes += 1
+            self.files += 1
+            self.bytes += len(data)
+        except OSError as e:
+            print(f"⚠️ Disk store write failed: {e}")
+
+    def delete(self, key: str):
+        self._remove(self._path(key))
+
+    def touch(self, key: str) -> bool:
+        """Marks an entry as used without reading it; False if it is not stored."""
+        try:
+            os.utime(self._path(key))
+            return True
+        except OSError:
+            return False
+
+    def sweep(self):
+        """Deletes idle files, then the least recently used ones until under max_bytes."""
+        cutoff = time.time() - self.max_age_seconds
+        entries = []
+        evicted = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if st.st_mtime < cutoff:
+                    evicted += self._remove(entry.path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        kept = len(entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                evicted += 1
+                kept -= 1
+                total -= size
+        self.evictions += evicted
+        self.files, self.bytes = kept, total
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def _ensure_sweeper(self):
+        # Threads do not survive fork(), so each worker starts its own sweeper
+        pid = os.getpid()
+        if self._sweeper is not None and self._sweeper_pid == pid and self._sweeper.is_alive():
+            return
+        with self._lock:
+            if self._sweeper is not None and self._sweeper_pid == pid and self._sweeper.is_alive():
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="disk-store-sweeper", daemon=True)
+            self._sweeper_pid = pid
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"⚠️ Disk store sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "files": self.files,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+# ------------------------------
+# In-Process LRU Cache
+# ------------------------------
+class PredictionCache:
+    """
+    Size-bounded LRU with a per-entry TTL, keyed by cache_key(). When a
+    backend is given, memory misses fall through to it and every write is
+    mirrored to it.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, backend=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.backend_hits = 0
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    with self._lock:
+                        self._store(key, value, expires_at)
+                        self.hits += 1
+                        self.backend_hits += 1
+                    return value
+                self.backend.delete(key)
+                with self._lock:
+                    self.expirations += 1
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, expires_at)
+            except OSError as e:
+                print(f"⚠️ Prediction cache backend write failed: {e}")
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "backend_hits": self.backend_hits,
+                "backend": type(self.backend).__name__ if self.backend is not None else None,
+                "backend_stats": self.backend.stats() if hasattr(self.backend, 'stats') else None,
+            }
+
+
+# ------------------------------
+# Prediction Sessions
+# ------------------------------
+class PredictionSessions:
+    """
+    Recent /predict results together with the uploaded image, keyed by
+    prediction id (the upload's cache_key()), so a client can ask for a
+    report by id instead of sending the photo and results back.
+
+    With `disk` (a BoundedDiskStore) entries live in a directory shared by
+    all workers and expire `max_age_seconds` after their last use there;
+    without it they are kept in a per-process LRU of `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 64, ttl_seconds: float = 3600, disk=None):
+        self.disk = disk
+        self.cache = PredictionCache(max_entries=max_entries, ttl_seconds=ttl_seconds) if disk is None else None
+
+    @staticmethod
+    def valid_id(prediction_id) -> bool:
+        return isinstance(prediction_id, str) and len(prediction_id) == 64 and \
+            all(c in '0123456789abcdef' for c in prediction_id)
+
+    def put(self, prediction_id: str, result: dict, image_bytes: bytes):
+        if self.disk is None:
+            self.cache.set(prediction_id, (result, image_bytes))
+            return
+        # A repeat upload only refreshes the stored copy's age
+        if self.disk.touch(f"{prediction_id}.image") and self.disk.touch(f"{prediction_id}.json"):
+            return
+        self.disk.set(f"{prediction_id}.image", image_bytes)
+        self.disk.set(f"{prediction_id}.json", json.dumps(result).encode('utf-8'))
+
+    def get(self, prediction_id: str):
+        """Returns (result, image_bytes), or None for unknown or expired ids."""
+        if not self.valid_id(prediction_id):
+            return None
+        if self.disk is None:
+            return self.cache.get(prediction_id)
+        meta = self.disk.get(f"{prediction_id}.json")
+        image_bytes = self.disk.get(f"{prediction_id}.image") if meta is not None else None
+        if image_bytes is None:
+            return None
+        try:
+            return json.loads(meta), image_bytes
+        except ValueError:
+            return None
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.cache.stats() if self.cache is not None else None,
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
@@ -0,0 +1,108 @@
+"""
+Fetch and verify the classifier checkpoint before the server starts.
+
+    python provision_model.py --output artifact_with_val.pth --sha256 <hex digest>
+
+Downloads the checkpoint from Google Drive into a temporary file, checks
+its SHA-256 and only then moves it into place, so a worker never starts
+on a partial or corrupted download. The apps no longer download anything
+at import time. Without --sha256 (or MODEL_SHA256), the digest recorded
+in <output>.sha256 by an earlier run is used, and the first run records
+it (trust on first use).
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+DRIVE_FILE_ID = "1zZU-WBIgGWRsPkdrHI-OPteYPVSD1Pqf"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkpoint_stat(path: str) -> list:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def same_checkpoint(recorded: dict, ckpt_path: str, verify: bool = False) -> bool:
+    """
+    Whether ckpt_path is the checkpoint a derived model was built from, as
+    recorded in its "checkpoint_stat" and "checkpoint_sha256". A matching
+    size and mtime is trusted unless `verify`; otherwise the file is hashed.
+    """
+    if not verify and recorded.get("checkpoint_stat") == checkpoint_stat(ckpt_path):
+        return True
+    return recorded.get("checkpoint_sha256") == file_sha256(ckpt_path)
+
+
+def checksum_path(ckpt_path: str) -> str:
+    return f"{ckpt_path}.sha256"
+
+
+def read_recorded_checksum(ckpt_path: str):
+    try:
+        with open(checksum_path(ckpt_path), encoding='utf-8') as f:
+            return f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def _record_checksum(ckpt_path: str, digest: str):
+    with open(checksum_path(ckpt_path), 'w', encoding='utf-8') as f:
+        f.write(f"{digest}  {os.path.basename(ckpt_path)}\n")
+
+
+def provision(output: str, file_id: str = DRIVE_FILE_ID, expected_sha256: str = None, force: bool = False) -> str:
+    expected = (expected_sha256 or read_recorded_checksum(output) or '').lower() or None
+
+    if os.path.exists(output) and not force:
+        digest = file_sha256(output)
+        if expected is None or digest == expected:
+            print(f"✅ {output} already present (sha256 {digest[:12]}…)")
+            _record_checksum(output, digest)
+            return digest
+        print(f"⚠️ {output} does not match the expected checksum; downloading again.")
+
+    import gdown
+
+    tmp_path = f"{output}.download"
+    url = f"https://drive.google.com/uc?id={file_id}"
+    print("📥 Downloading model from Google Drive…")
+    if gdown.download(url, tmp_path, quiet=False) is None or not os.path.exists(tmp_path):
+        raise RuntimeError(f"Download of {url} failed")
+
+    digest = file_sha256(tmp_path)
+    if expected is not None and digest != expected:
+        os.remove(tmp_path)
+        raise RuntimeError(f"Checksum mismatch for {output}: expected {expected}, got {digest}")
+    os.replace(tmp_path, output)
+
+    if expected is None:
+        print(f"⚠️ No checksum given; recording {digest} in {checksum_path(output)}")
+    _record_checksum(output, digest)
+    print(f"✅ {output} provisioned (sha256 {digest[:12]}…)")
+    return digest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='artifact_with_val.pth')
+    parser.add_argument('--file-id', default=DRIVE_FILE_ID, help="Google Drive file ID of the checkpoint")
+    parser.add_argument('--sha256', default=os.environ.get('MODEL_SHA256'), help="Expected SHA-256 of the checkpoint")
+    parser.add_argument('--force', action='store_true', help="Download even if a matching file is present")
+    args = parser.parse_args(argv)
+    try:
+        provision(args.output, args.file_id, args.sha256, args.force)
+    except RuntimeError as e:
+        sys.exit(f"❌ {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Post-training static INT8 quantization of the artifact classifier.
+
+    python quantize.py --checkpoint artifact_with_val.pth --calibration-dir calibration_images/
+
+Calibrates activation ranges on a folder of sample images, converts the
+model with FX graph mode quantization and checks top-1 agreement and
+latency against the float model. The INT8 TorchScript file
+(<checkpoint>.int8.pt) and its check report (<checkpoint>.int8.json) are
+only written when agreement reaches --min-agreement. The report records
+the checkpoint's size, mtime and SHA-256, and the apps serve the float
+model instead once the checkpoint is replaced.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import torch
+from PIL import Image as PILImage, UnidentifiedImageError
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from artifact_model import NUM_CLASSES, create_serving_model, load_checkpoint, image_transforms
+from provision_model import checkpoint_stat, file_sha256, same_checkpoint
+
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# The INT8 model is matched to the checkpoint like the compiled model: by
+# size and mtime, falling back to the SHA-256, which
+# QUANTIZED_MODEL_VERIFY_SHA256=1 always checks.
+VERIFY_SHA256 = os.environ.get('QUANTIZED_MODEL_VERIFY_SHA256', '0') == '1'
+
+
+def quantized_paths(ckpt_path: str):
+    """Returns the (model, report) paths that sit next to a float checkpoint."""
+    base = os.path.splitext(ckpt_path)[0]
+    return f"{base}.int8.pt", f"{base}.int8.json"
+
+
+def load_image_folder(folder: str, limit: int = 256) -> list:
+    tensors = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.lower().endswith(VALID_EXTENSIONS):
+                continue
+            try:
+                img = PILImage.open(os.path.join(root, name)).convert('RGB')
+            except (UnidentifiedImageError, OSError):
+                print(f"⚠️ Skipping unreadable image: {name}")
+                continue
+            tensors.append(image_transforms(img))
+            if len(tensors) >= limit:
+                return tensors
+    return tensors
+
+
+def _batches(tensors: list, batch_size: int):
+    for i in range(0, len(tensors), batch_size):
+        yield torch.stack(tensors[i:i + batch_size])
+
+
+def quantize_model(float_model, calibration: list, batch_size: int = 8, backend: str = 'x86'):
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(float_model).eval()
+    example = calibration[0].unsqueeze(0)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=(example,))
+    with torch.no_grad():
+        for batch in _batches(calibration, batch_size):
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def compare_models(float_model, int8_model, images: list, batch_size: int = 8) -> dict:
+    """Top-1 agreement and per-image latency of the INT8 model against the float model."""
+    agree = 0
+    float_time = int8_time = 0.0
+    with torch.inference_mode():
+        for batch in _batches(images, batch_size):
+            start = time.perf_counter()
+            float_top1 = float_model(batch).argmax(dim=1)
+            float_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            int8_top1 = int8_model(batch).argmax(dim=1)
+            int8_time += time.perf_counter() - start
+
+            agree += int((float_top1 == int8_top1).sum())
+    n = len(images)
+    return {
+        "images": n,
+        "top1_agreement": agree / n,
+        "float_ms_per_image": 1000.0 * float_time / n,
+        "int8_ms_per_image": 1000.0 * int8_time / n,
+    }
+
+
+def save_quantized(int8_model, path: str, example: torch.Tensor):
+    with torch.no_grad():
+        traced = torch.jit.trace(int8_model, example)
+        traced = torch.jit.freeze(traced.eval())
+    torch.jit.save(traced, path)
+
+
+def load_quantized(ckpt_path: str, min_agreement: float, verify: bool = VERIFY_SHA256):
+    """
+    Loads the INT8 model built for ckpt_path, or returns None when it is
+    missing, was built from a different checkpoint, or its recorded check
+    did not reach min_agreement.
+    """
+    model_path, report_path = quantized_paths(ckpt_path)
+    if not (os.path.exists(model_path) and os.path.exists(report_path)):
+        print(f"⚠️ INT8 model not found next to {ckpt_path}; run quantize.py first.")
+        return None
+    with open(report_path, encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get("top1_agreement", 0.0) < min_agreement:
+        print(f"⚠️ INT8 model agreement {report.get('top1_agreement')} is below {min_agreement}; not deploying it.")
+        return None
+    if os.path.exists(ckpt_path) and not same_checkpoint(report, ckpt_path, verify):
+        print(f"⚠️ {model_path} was quantized from a different checkpoint; run quantize.py again. Serving fp32.")
+        return None
+    torch.backends.quantized.engine = report.get("backend", "x86")
+    model = torch.jit.load(model_path, map_location='cpu')
+    model.eval()
+    print(f"✅ INT8 model loaded ({report['top1_agreement']:.1%} top-1 agreement, "
+          f"{report['int8_ms_per_image']:.1f} vs {report['float_ms_per_image']:.1f} ms/image)")
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkpoint', default='artifact_with_val.pth')
+    parser.add_argument('--calibration-dir', required=True, help="Folder of sample images used to calibrate activation ranges")
+    parser.add_argument('--eval-dir', help="Folder used for the agreement check (defaults to --calibration-dir)")
+    parser.add_argument('--limit', type=int, default=256, help="Maximum number of images read from each folder")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--min-agreement', type=float, default=0.98)
+    parser.add_argument('--backend', default='x86', choices=['x86', 'fbgemm', 'qnnpack', 'onednn'])
+    args = parser.parse_args(argv)
+
+    float_model = load_checkpoint(create_serving_model(NUM_CLASSES), args.checkpoint)
+
+    calibration = load_image_folder(args.calibration_dir, args.limit)
+    if not calibration:
+        sys.exit(f"No images found in {args.calibration_dir}")
+    evaluation = load_image_folder(args.eval_dir, args.limit) if args.eval_dir else calibration
+    print(f"Calibrating on {len(calibration)} images, checking on {len(evaluation)}")
+
+    int8_model = quantize_model(float_model, calibration, args.batch_size, args.backend)
+    report = compare_models(float_model, int8_model, evaluation, args.batch_size)
+    report.update(backend=args.backend, checkpoint=os.path.basename(args.checkpoint), min_agreement=args.min_agreement,
+                  checkpoint_sha256=file_sha256(args.checkpoint), checkpoint_stat=checkpoint_stat(args.checkpoint))
+    print(json.dumps(report, indent=2))
+
+    if report["top1_agreement"] < args.min_agreement:
+        sys.exit(f"❌ Top-1 agreement {report['top1_agreement']:.1%} is below {args.min_agreement:.1%}; INT8 model not written.")
+
+    model_path, report_path = quantized_paths(args.checkpoint)
+    save_quantized(int8_model, model_path, calibration[0].unsqueeze(0))
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Wrote {model_path} ({os.path.getsize(model_path) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+ReportLab story for the artifact analysis PDF.
+
+Kept free of the model, the web framework and matplotlib so the report
+worker processes started by pdf_jobs.py import only this module.
+"""
+import base64
+import functools
+import io
+import os
+import time
+
+from PIL import Image as PILImage, ImageOps
+
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
+
+from era_index import format_year
+
+
+# The uploaded photo is embedded within a 4x3 inch box; it is downscaled
+# to REPORT_IMAGE_DPI at that size and re-encoded as JPEG, which ReportLab
+# stores as-is, so a large camera photo no longer bloats the PDF.
+REPORT_IMAGE_DPI = int(os.environ.get('REPORT_IMAGE_DPI', 150))
+REPORT_IMAGE_QUALITY = int(os.environ.get('REPORT_IMAGE_QUALITY', 85))
+IMAGE_BOX = (4*inch, 3*inch)
+
+# Streams are only Flate-compressed; the extra ASCII85 pass is done in
+# pure Python and just makes the file a quarter larger
+rl_config.useA85 = 0
+
+
+def decode_image_data(image_data: str) -> bytes:
+    """Raw bytes of a base64 image, optionally given as a data: URL."""
+    if image_data.startswith('data:'):
+        image_data = image_data.split(',', 1)[1]
+    return base64.b64decode(image_data)
+
+
+def report_image(image_bytes: bytes, box=IMAGE_BOX, dpi: int = REPORT_IMAGE_DPI) -> Image:
+    """
+    Decodes an uploaded image into a flowable that fits `box` (points)
+    with its aspect ratio kept, entirely in memory.
+    """
+    img = PILImage.open(io.BytesIO(image_bytes))
+    max_px = (round(box[0] / inch * dpi), round(box[1] / inch * dpi))
+    # Lets the JPEG decoder skip straight to a reduced scale
+    img.draft('RGB', max_px)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        rgba = img.convert('RGBA')
+        img = PILImage.new('RGB', rgba.size, 'white')
+        img.paste(rgba, mask=rgba.getchannel('A'))
+    img.thumbnail(max_px, PILImage.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=REPORT_IMAGE_QUALITY, optimize=True)
+    buffer.seek(0)
+    scale = min(box[0] / img.width, box[1] / img.height)
+    return Image(buffer, width=img.width * scale, height=img.height * scale)
+
+
+# ------------------------------
+# Report Template
+# ------------------------------
+# Styles are built once per process. Sections that depend only on the
+# predicted class (its DETAILS_MAP text) or on the site list are parsed
+# and line-broken once, then reused by every report the process builds;
+# a request only lays out its own confidence, top-k table and C14 page.
+_sample_styles = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_sample_styles['Heading1'],
+    fontSize=16,
+    spaceAfter=30,
+    alignment=TA_CENTER
+)
+
+HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_sample_styles['Heading2'],
+    fontSize=14,
+    spaceAfter=12,
+    spaceBefore=12
+)
+
+NORMAL_STYLE = ParagraphStyle(
+    'CustomNormal',
+    parent=_sample_styles['BodyText'],
+    fontSize=10,
+    spaceAfter=6,
+    alignment=TA_JUSTIFY
+)
+
+SMALL_STYLE = ParagraphStyle(
+    'CustomSmall',
+    parent=_sample_styles['BodyText'],
+    fontSize=9,
+    spaceAfter=4
+)
+
+TOP_K_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+
+class PreparedParagraph(Paragraph):
+    """
+    Paragraph that keeps its line breaks while it is wrapped at the same
+    width again, so one instance can be laid out once and then reused by
+    every report. A process builds one report at a time, so sharing
+    instances between reports is safe.
+    """
+    _wrapped = None
+
+    def wrap(self, availWidth, availHeight):
+        # split() may drop blPara when the paragraph moves to the next page
+        if self._wrapped is not None and self._wrapped[0] == availWidth and 'blPara' in self.__dict__:
+            return self._wrapped[1]
+        size = super().wrap(availWidth, availHeight)
+        self._wrapped = (availWidth, size)
+        return size
+
+
+_HEADER = (
+    PreparedParagraph("Archaeological Artifact Analysis Report", TITLE_STYLE),
+    Spacer(1, 20),
+)
+
+_C14_CONTEXT = (
+    PreparedParagraph("Historical Context:", HEADING_STYLE),
+    PreparedParagraph("This date places your artifact within the following historical periods:", NORMAL_STYLE),
+)
+
+_FOOTER_NOTE = PreparedParagraph("Generated by Archaeological Artifact Identification System", SMALL_STYLE)
+
+_DETAIL_FIELDS = (
+    ("Description", 'description'),
+    ("Historical Era", 'era'),
+    ("Material Composition", 'material'),
+    ("Cultural Significance", 'significance'),
+    ("Cultural Context", 'cultural_context'),
+    ("Technological Markers", 'technological_markers'),
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _details_section(detail_values: tuple) -> tuple:
+    story = [PreparedParagraph("Detailed Artifact Information", HEADING_STYLE)]
+    for (title, _), content in zip(_DETAIL_FIELDS, detail_values):
+        if content != 'N/A':
+            story.append(PreparedParagraph(f"<b>{title}:</b>", NORMAL_STYLE))
+            story.append(PreparedParagraph(content, SMALL_STYLE))
+            story.append(Spacer(1, 8))
+    return tuple(story)
+
+
+@functools.lru_cache(maxsize=8)
+def _sites_section(sites: tuple) -> tuple:
+    story = [
+        PreparedParagraph("Archaeological Sites Near Rajapalayam, Tamil Nadu", HEADING_STYLE),
+        PreparedParagraph("Explore these significant archaeological sites in the region:", NORMAL_STYLE),
+        Spacer(1, 10),
+    ]
+    for i, (name, distance, significance, key_artifacts) in enumerate(sites, 1):
+        story.append(PreparedParagraph(f"<b>{i}. {name}</b>", NORMAL_STYLE))
+        story.append(PreparedParagraph(f"<i>Distance: {distance}</i>", SMALL_STYLE))
+        story.append(PreparedParagraph(f"<b>Significance:</b> {significance}", SMALL_STYLE))
+        story.append(PreparedParagraph(f"<b>Key Artifacts:</b> {key_artifacts}", SMALL_STYLE))
+        story.append(Spacer(1, 12))
+    return tuple(story)
+
+
+def details_section(details: dict) -> tuple:
+    """Cached flowables for a class's DETAILS_MAP entry."""
+    return _details_section(tuple(details.get(key) or 'N/A' for _, key in _DETAIL_FIELDS))
+
+
+def sites_section(regional_finds: list) -> tuple:
+    """
+    Cached flowables for the report's site list (the few nearest sites,
+    not the whole catalogue). Fields a catalogue lacks print as N/A.
+    """
+    return _sites_section(tuple(
+        tuple(site.get(key) or 'N/A' for key in ('site', 'distance', 'significance', 'key_artifacts'))
+        for site in regional_finds
+    ))
+
+
+def build_report(data: dict, regional_finds: list, chart_png: bytes = None, image_bytes: bytes = None) -> bytes:
+    """
+    Builds the report for one /generate_pdf payload and returns the PDF
+    bytes. `chart_png` is the confidence chart behind data['chart_url'],
+    resolved by the caller. `image_bytes`, the upload of a stored
+    prediction, takes the place of data['image_data'].
+    """
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+
+    story = list(_HEADER)
+
+    image_data = data.get('image_data')
+    if image_bytes is not None or image_data:
+        try:
+            image = report_image(image_bytes if image_bytes is not None else decode_image_data(image_data))
+            story.append(Paragraph("Uploaded Artifact Image", HEADING_STYLE))
+            story.append(Spacer(1, 10))
+            story.append(image)
+            story.append(Spacer(1, 20))
+        except Exception as e:
+            print(f"Error processing image: {e}")
+
+    top1 = data.get('top1') or {}
+    if top1:
+        story.append(Paragraph(f"Primary Identification: <b>{top1.get('class', 'Unknown')}</b>", HEADING_STYLE))
+        story.append(Paragraph(f"Confidence: {top1.get('probability', 0)*100:.2f}%", NORMAL_STYLE))
+        story.append(Spacer(1, 10))
+
+    if chart_png is not None:
+        story.append(Image(io.BytesIO(chart_png), width=6*inch, height=4*inch))
+        story.append(Spacer(1, 15))
+
+    details = data.get('details') or {}
+    if details:
+        story.extend(details_section(details))
+
+    top_k = data.get('top_k') or []
+    if top_k:
+        story.append(PageBreak())
+        story.append(Paragraph("Complete Classification Results", HEADING_STYLE))
+
+        table_data = [['Rank', 'Artifact Type', 'Confidence']]
+        for i, prediction in enumerate(top_k, 1):
+            table_data.append([
+                str(i),
+                prediction.get('class', 'Unknown'),
+                f"{prediction.get('probability', 0)*100:.2f}%"
+            ])
+
+        table = Table(table_data, colWidths=[1*inch, 3*inch, 1.5*inch])
+        table.setStyle(TOP_K_TABLE_STYLE)
+
+        story.append(table)
+        story.append(Spacer(1, 20))
+
+    story.extend(sites_section(regional_finds))
+
+    c14_data = data.get('c14_data')
+    if c14_data:
+        story.append(PageBreak())
+        story.append(Paragraph("Carbon-14 Dating Analysis", HEADING_STYLE))
+        story.append(Paragraph(f"Original C14 Percentage: {c14_data.get('original_percentage', 'N/A')}%", NORMAL_STYLE))
+        story.append(Paragraph(f"Calculated Age (BP): {c14_data.get('age_bp', 'N/A')} years", NORMAL_STYLE))
+        story.append(Paragraph(f"Calendar Year: {c14_data.get('calendar_year', 'N/A')} CE/BCE", NORMAL_STYLE))
+        story.append(Spacer(1, 10))
+        story.extend(_C14_CONTEXT)
+        # Filled in by the server from the era index
+        eras = c14_data.get('eras') or []
+        for era in eras:
+            story.append(Paragraph(
+                f"<b>{era['name']}</b> ({format_year(era['start'])} to {format_year(era['end'])}): "
+                f"{era.get('description', '')}", SMALL_STYLE))
+        if not eras:
+            story.append(Paragraph("No period in the timeline covers this date.", SMALL_STYLE))
+
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(f"Report generated on: {time.strftime('%Y-%m-%d %H:%M:%S')}", SMALL_STYLE))
+    story.append(_FOOTER_NOTE)
+
+    # ReportLab marks a flowable that was pushed to the next page and never
+    # clears the mark, which would break the shared ones in a later report
+    for flowable in story:
+        flowable.__dict__.pop('_postponed', None)
+
+    doc.build(story)
+    return buffer.getvalue()
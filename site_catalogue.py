@@ -0,0 +1,258 @@
+"""
+Archaeological site catalogue behind /regional_finds and the PDF report.
+
+Sites are held column by column: coordinates in NumPy arrays and every
+text field as a tuple of interned strings, so repeated values (an era, a
+district) are stored once and no per-site dict exists until a site is
+returned. The catalogue can be read from a GeoJSON or CSV file, which is
+watched and swapped for a rebuilt catalogue when it changes.
+"""
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from site_index import SiteIndex
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# ------------------------------
+# Columnar Catalogue
+# ------------------------------
+class SiteCatalogue:
+    """
+    Immutable set of sites with a SiteIndex over their coordinates.
+    `columns` maps each other field name to one value per site; None
+    means the site does not have that field.
+    """
+
+    def __init__(self, lat, lon, columns: dict, source: str = None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        bad = np.flatnonzero(~(np.isfinite(self.lat) & np.isfinite(self.lon)
+                               & (np.abs(self.lat) <= 90) & (np.abs(self.lon) <= 180)))
+        if len(bad):
+            raise ValueError(f"site {bad[0] + 1} has invalid coordinates "
+                             f"({self.lat[bad[0]]}, {self.lon[bad[0]]})")
+        self.columns = {_intern(name): tuple(_intern(v) for v in values) for name, values in columns.items()}
+        for name, values in self.columns.items():
+            if len(values) != len(self.lat):
+                raise ValueError(f"column {name!r} has {len(values)} values for {len(self.lat)} sites")
+        self.source = source
+        self.index = SiteIndex(self.lat, self.lon)
+        # Records keep the REGIONAL_FINDS field order: name, coordinates, details
+        fields = list(self.columns.items())
+        self._head, self._tail = fields[:1], fields[1:]
+
+    @classmethod
+    def from_records(cls, records, source: str = None) -> "SiteCatalogue":
+        """Builds a catalogue from {"lat", "lon", ...} dicts such as REGIONAL_FINDS."""
+        records = list(records)
+        names = []
+        for record in records:
+            names.extend(name for name in record if name not in ('lat', 'lon') and name not in names)
+        try:
+            lat = [float(record['lat']) for record in records]
+            lon = [float(record['lon']) for record in records]
+        except KeyError as e:
+            raise ValueError(f"site without {e.args[0]!r}") from None
+        columns = {name: [record.get(name) for record in records] for name in names}
+        return cls(lat, lon, columns, source=source)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def record(self, i: int) -> dict:
+        """Site i as a new dict."""
+        record = {name: values[i] for name, values in self._head if values[i] is not None}
+        record['lat'], record['lon'] = float(self.lat[i]), float(self.lon[i])
+        record.update((name, values[i]) for name, values in self._tail if values[i] is not None)
+        return record
+
+    def records(self, limit: int = None) -> list:
+        """The first `limit` sites (all by default) as dicts, in catalogue order."""
+        return [self.record(i) for i in range(len(self) if limit is None else min(limit, len(self)))]
+
+    def nearest(self, lat: float, lon: float, k: int = None, radius_km: float = None) -> list:
+        """
+        Sites sorted by distance from (lat, lon), limited as in
+        SiteIndex.query(), with 'distance' and 'distance_km' added.
+        """
+        indices, distances = self.index.query(lat, lon, k=k, radius_km=radius_km)
+        results = []
+        for i, d in zip(indices.tolist(), distances.tolist()):
+            record = self.record(i)
+            record['distance'] = f"Approx. {round(d)} km away"
+            record['distance_km'] = round(d, 1)
+            results.append(record)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "sites": len(self),
+            "fields": list(self.columns),
+            "distinct_values": {name: len(set(values)) for name, values in self.columns.items()},
+            "cell_km": self.index.cell_km,
+        }
+
+
+# ------------------------------
+# File Loaders
+# ------------------------------
+def _load_geojson(path: str) -> SiteCatalogue:
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    features = data.get('features') if isinstance(data, dict) else None
+    if features is None:
+        raise ValueError("expected a GeoJSON FeatureCollection")
+    records = []
+    for n, feature in enumerate(features, 1):
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') != 'Point':
+            raise ValueError(f"feature {n} is not a Point")
+        lon, lat = geometry['coordinates'][:2]
+        records.append({**(feature.get('properties') or {}), 'lat': lat, 'lon': lon})
+    return SiteCatalogue.from_records(records, source=path)
+
+
+def _load_csv(path: str) -> SiteCatalogue:
+    # Empty cells count as missing fields
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = [{name: value for name, value in row.items() if value not in ('', None)}
+                for row in csv.DictReader(f)]
+    try:
+        return SiteCatalogue.from_records(rows, source=path)
+    except ValueError as e:
+        raise ValueError(f"{e} (lat and lon columns must hold decimal degrees)") from None
+
+
+def load_catalogue(path: str) -> SiteCatalogue:
+    """Reads a .geojson/.json FeatureCollection of points or a .csv with lat and lon columns."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.geojson', '.json'):
+        return _load_geojson(path)
+    if extension == '.csv':
+        return _load_csv(path)
+    raise ValueError(f"unsupported site catalogue format: {path}")
+
+
+# ------------------------------
+# Hot Reload
+# ------------------------------
+class CatalogueSource:
+    """
+    Holds the current SiteCatalogue. With a `path`, the file is loaded at
+    startup and a background thread checks it every `poll_interval`
+    seconds; when it changes, a new catalogue is built next to the old
+    one and swapped in with a single assignment, so a request that has
+    read `current` keeps a consistent catalogue. A file that fails to
+    load leaves the previous catalogue (or `default_records`) in place.
+
+    `on_load(catalogue)`, if given, is called with every catalogue before
+    it becomes current, to rebuild anything derived from it.
+    """
+
+    def __init__(self, path: str = None, default_records=(), poll_interval: float = 5.0, on_load=None):
+        self.path = path or None
+        self.poll_interval = poll_interval
+        self.on_load = on_load
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self._signature = None
+
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error = None
+        self.loaded_at = None
+
+        self._catalogue = SiteCatalogue.from_records(default_records, source="built-in")
+        if self.on_load is not None:
+            self.on_load(self._catalogue)
+        if self.path:
+            self.reload()
+
+    @property
+    def current(self) -> SiteCatalogue:
+        self._ensure_watcher()
+        return self._catalogue
+
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        # The inode changes when the file is replaced by a rename
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def reload(self) -> bool:
+        """Loads the file again; returns False and keeps the old catalogue on failure."""
+        with self._lock:
+            try:
+                signature = self._stat_signature()
+                start = time.perf_counter()
+                catalogue = load_catalogue(self.path)
+                if self.on_load is not None:
+                    self.on_load(catalogue)
+            except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+                self.reload_errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                try:
+                    # Not retried until the file changes again
+                    self._signature = self._stat_signature()
+                except OSError:
+                    self._signature = None
+                print(f"⚠️ Site catalogue {self.path} not loaded: {self.last_error}")
+                return False
+            self._catalogue = catalogue
+            self._signature = signature
+            self.reloads += 1
+            self.last_error = None
+            self.loaded_at = time.time()
+            print(f"✅ Site catalogue loaded: {len(catalogue)} sites from {self.path} "
+                  f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return True
+
+    def check(self):
+        """Reloads if the file has changed since it was last read."""
+        try:
+            signature = self._stat_signature()
+        except OSError:
+            signature = None
+        if signature is not None and signature != self._signature:
+            self.reload()
+
+    def _ensure_watcher(self):
+        # Threads do not survive fork(), so each worker starts its own watcher
+        if not self.path:
+            return
+        pid = os.getpid()
+        if self._watcher is not None and self._watcher_pid == pid and self._watcher.is_alive():
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher_pid == pid and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, name="site-catalogue-watcher", daemon=True)
+            self._watcher_pid = pid
+            self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "poll_interval": self.poll_interval,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "loaded_at": self.loaded_at,
+            "catalogue": self._catalogue.stats(),
+        }
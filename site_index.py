@@ -0,0 +1,159 @@
+"""
+Spatial index for the site catalogue: the k nearest sites, or those
+within a radius, without measuring the distance to every site.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+
+def _unit_vectors(lat, lon):
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def _chord(radius_km: float) -> float:
+    # Straight-line distance through the unit sphere for an arc of radius_km
+    return 2.0 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2.0)
+
+
+def _arc_km(chord):
+    """Inverse of _chord(): the great-circle (haversine) distance in km."""
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2.0, 1.0))
+
+
+# ------------------------------
+# Site Index
+# ------------------------------
+class SiteIndex:
+    """
+    Nearest-site lookups over arrays of site latitudes and longitudes
+    (degrees); results are positions in those arrays.
+
+    Sites are kept as unit vectors bucketed into a 3-D grid of cubes
+    (`cell_km` on a side, sized to the catalogue's density), so a query
+    only measures the sites in the cells around it, with no special
+    cases at the poles or the antimeridian. Candidates are compared by
+    straight-line (chord) distance, which orders them exactly like the
+    great-circle distance and needs no trigonometry; only the returned
+    rows are converted to km.
+    """
+
+    def __init__(self, lat, lon, cell_km: float = None, max_cell_km: float = 50.0, target_per_cell: int = 4):
+        lat = np.radians(np.asarray(lat, dtype=np.float64))
+        lon = np.radians(np.asarray(lon, dtype=np.float64))
+        self.xyz = _unit_vectors(lat, lon).reshape(-1, 3)
+        self.size = len(self.xyz)
+
+        # Without an explicit cell_km, cells shrink from max_cell_km until a
+        # cell holds about target_per_cell sites, so dense regions stay cheap
+        cell_km = cell_km or max_cell_km
+        self._build(cell_km)
+        while cell_km > 1.0 and len(self._keys) and self.size / len(self._keys) > target_per_cell:
+            cell_km /= 2
+            self._build(cell_km)
+        self.cell_km = cell_km
+
+    def _build(self, cell_km: float):
+        self.cell = cell_km / EARTH_RADIUS_KM
+        # Cell coordinates lie in [-span, span]; each cell gets one integer key
+        self._span = int(np.ceil(1.0 / self.cell)) + 1
+        self._dim = 2 * self._span + 1
+        cells = np.floor(self.xyz / self.cell).astype(np.int64)
+        keys = self._key(cells)
+        self._keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        self._cells = cells[first]
+        self._centers = (self._cells + 0.5) * self.cell
+        # Site indices grouped by cell: cell i owns _order[_starts[i]:_starts[i] + _counts[i]]
+        self._order = np.argsort(inverse, kind='stable')
+        self._counts = np.bincount(inverse, minlength=len(self._keys))
+        self._starts = np.cumsum(self._counts) - self._counts
+        self._neighbour_offsets = {}
+
+    def _key(self, cells):
+        shifted = cells + self._span
+        return (shifted[..., 0] * self._dim + shifted[..., 1]) * self._dim + shifted[..., 2]
+
+    def __len__(self):
+        return self.size
+
+    def _near_cells(self, q_xyz, chord: float) -> np.ndarray:
+        """Positions in _keys of the occupied cells that can hold sites within `chord` of q_xyz."""
+        reach = int(chord / self.cell) + 1
+        if 8 * (2 * reach + 1) ** 3 >= len(self._keys):
+            # Cheaper to test every occupied cell than to look up the whole neighbourhood
+            diff = self._centers - q_xyz
+            center_dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+            return np.flatnonzero(center_dist - self.cell * np.sqrt(3) / 2 <= chord)
+        offsets = self._neighbour_offsets.get(reach)
+        if offsets is None:
+            r = np.arange(-reach, reach + 1)
+            offsets = ((r[:, None, None] * self._dim + r[None, :, None]) * self._dim + r[None, None, :]).ravel()
+            self._neighbour_offsets[reach] = offsets
+        wanted = self._key(np.floor(q_xyz / self.cell).astype(np.int64)) + offsets
+        pos = np.minimum(np.searchsorted(self._keys, wanted), len(self._keys) - 1)
+        return pos[self._keys[pos] == wanted]
+
+    def _knn_cells(self, q_xyz, k: int) -> np.ndarray:
+        """Positions in _keys of the occupied cells that can hold one of the k nearest sites."""
+        half_diagonal = self.cell * np.sqrt(3) / 2
+        diff = self._centers - q_xyz
+        center_dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        lower = np.maximum(center_dist - half_diagonal, 0.0)
+        # Every occupied cell holds a site, so the k cells with the lowest
+        # bound hold at least k sites, all within `upper` of the query
+        closest = np.argpartition(lower, k - 1)[:k] if k < len(lower) else slice(None)
+        upper = (center_dist[closest] + half_diagonal).max()
+        return np.flatnonzero(lower <= upper)
+
+    def _gather(self, q_xyz, near: np.ndarray):
+        """(indices, chord distances) of the sites in the given cells."""
+        starts, counts = self._starts[near], self._counts[near]
+        total = int(counts.sum())
+        if 2 * total > self.size:
+            # Gathering most of the catalogue costs more than measuring all of it
+            idx = np.arange(self.size)
+        else:
+            offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+            idx = self._order[offsets]
+        diff = self.xyz[idx] - q_xyz
+        return idx, np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    def _candidates(self, q_xyz, chord: float):
+        """
+        (indices, chord distances) of all sites within `chord` of q_xyz,
+        plus some just outside.
+        """
+        return self._gather(q_xyz, self._near_cells(q_xyz, chord))
+
+    def query(self, lat: float, lon: float, k: int = None, radius_km: float = None):
+        """
+        Sites nearest to (lat, lon) in degrees, as (indices, distances_km)
+        sorted by distance: the `k` nearest, those within `radius_km`, or
+        both limits combined. With neither, every site is returned.
+        """
+        if not self.size:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        q_xyz = _unit_vectors(np.radians([lat]), np.radians([lon]))[0]
+
+        if radius_km is not None:
+            limit = _chord(radius_km)
+            idx, dist = self._candidates(q_xyz, limit)
+            keep = dist <= limit
+            idx, dist = idx[keep], dist[keep]
+        elif k is not None and k < self.size:
+            # Usually the k nearest are in the neighbouring cells; that is
+            # certain once the k-th candidate lies inside the searched radius
+            limit = _chord(self.cell_km)
+            idx, dist = self._candidates(q_xyz, limit)
+            if len(idx) < k or np.partition(dist, k - 1)[k - 1] > limit:
+                idx, dist = self._gather(q_xyz, self._knn_cells(q_xyz, k))
+        else:
+            idx, dist = self._candidates(q_xyz, 2.0)
+
+        if k is not None and k < len(idx):
+            nearest = np.argpartition(dist, k - 1)[:k]
+            idx, dist = idx[nearest], dist[nearest]
+        order = np.argsort(dist, kind='stable')
+        return idx[order], _arc_km(dist[order])
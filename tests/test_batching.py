@@ -0,0 +1,29 @@
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_results_go_back_to_their_callers():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [f.result(timeout=5) for f in futures] == [i * 2 for i in range(10)]
+    assert batcher.requests_total == 10
+
+
+@pytest.mark.parametrize("run_batch", [lambda items: items[:-1], lambda items: items + items])
+def test_wrong_result_count_fails_the_whole_batch(run_batch):
+    batcher = MicroBatcher(run_batch, max_batch_size=3, max_wait_ms=200)
+    futures = [batcher.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    assert batcher.errors_total >= 1
+
+
+def test_run_batch_errors_reach_every_caller():
+    def fail(items):
+        raise RuntimeError("model crashed")
+
+    batcher = MicroBatcher(fail)
+    with pytest.raises(RuntimeError):
+        batcher.submit(1).result(timeout=5)
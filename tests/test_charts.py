@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from charts import _CHART_ID_RE, decode_chart_id, encode_chart_id
+
+
+def test_chart_id_round_trip():
+    rng = np.random.default_rng(0)
+    for num_classes in (1, 2, 7, 30):
+        probs = rng.dirichlet(np.ones(num_classes))
+        chart_id = encode_chart_id(probs)
+        assert _CHART_ID_RE.match(chart_id)
+        decoded = decode_chart_id(chart_id, num_classes)
+        assert decoded.shape == (num_classes,)
+        assert np.abs(decoded - probs).max() <= 0.5 / 65535 + 1e-12
+
+
+def test_chart_id_is_deterministic_and_clipped():
+    assert encode_chart_id([0.25, 0.75]) == encode_chart_id(np.array([0.25, 0.75]))
+    np.testing.assert_array_equal(decode_chart_id(encode_chart_id([-0.5, 1.5]), 2), [0.0, 1.0])
+
+
+@pytest.mark.parametrize("chart_id", ["", "abc/def", "abc=", "a b", "../x"])
+def test_decode_rejects_malformed_ids(chart_id):
+    with pytest.raises(ValueError):
+        decode_chart_id(chart_id, 2)
+
+
+def test_decode_rejects_wrong_length():
+    chart_id = encode_chart_id([0.1, 0.2, 0.7])
+    with pytest.raises(ValueError):
+        decode_chart_id(chart_id, 2)
+    with pytest.raises(ValueError):
+        decode_chart_id(chart_id, 4)
@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+import pytest
+
+from classify_folder import Journal, JsonlWriter, find_images, open_writer, softmax
+
+HEADER = {"folder": "archive", "checkpoint": "artifact_with_val.pth"}
+
+
+def read_rows(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_journal_resumes_recorded_files(tmp_path):
+    path = str(tmp_path / "out.jsonl.journal")
+    journal = Journal(path, HEADER)
+    assert journal.done == set() and journal.position is None
+    journal.record(10, ["a.jpg", "b.jpg"])
+    journal.record(25, ["c.jpg"])
+    journal.close()
+
+    journal = Journal(path, HEADER)
+    assert journal.done == {"a.jpg", "b.jpg", "c.jpg"}
+    assert journal.position == 25
+    journal.close()
+
+
+@pytest.mark.parametrize("tail", [b'{"position": 40, "files": ["d.j', b'{"position": 40, "files": ["d.jpg"]}', b'garbage\n'])
+def test_journal_ignores_and_truncates_an_incomplete_line(tmp_path, tail):
+    path = tmp_path / "out.jsonl.journal"
+    journal = Journal(str(path), HEADER)
+    journal.record(10, ["a.jpg"])
+    journal.close()
+    complete = path.read_bytes()
+    with open(path, 'ab') as f:
+        f.write(tail)
+
+    journal = Journal(str(path), HEADER)
+    assert journal.done == {"a.jpg"} and journal.position == 10
+    assert path.read_bytes() == complete
+    journal.record(20, ["b.jpg"])
+    journal.close()
+    assert Journal(str(path), HEADER).done == {"a.jpg", "b.jpg"}
+
+
+def test_journal_rewrites_a_cut_header(tmp_path):
+    path = tmp_path / "out.jsonl.journal"
+    path.write_bytes(json.dumps(HEADER).encode('utf-8')[:5])
+    Journal(str(path), HEADER).close()
+    assert path.read_bytes() == json.dumps(HEADER).encode('utf-8') + b"\n"
+
+
+def test_journal_rejects_a_different_run(tmp_path):
+    path = str(tmp_path / "out.jsonl.journal")
+    Journal(path, HEADER).close()
+    with pytest.raises(ValueError):
+        Journal(path, {**HEADER, "checkpoint": "other.pth"})
+
+
+def test_resume_discards_rows_written_after_the_last_entry(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    writer, journal = JsonlWriter(output), Journal(output + ".journal", HEADER)
+    journal.record(writer.write([{"path": "a.jpg"}, {"path": "b.jpg"}]), ["a.jpg", "b.jpg"])
+    writer.write([{"path": "c.jpg"}])  # interrupted before the journal entry
+    writer.close()
+    journal.close()
+
+    writer, journal = JsonlWriter(output), Journal(output + ".journal", HEADER)
+    writer.truncate(journal.position)
+    assert [row["path"] for row in read_rows(output)] == ["a.jpg", "b.jpg"]
+    journal.record(writer.write([{"path": "c.jpg"}]), ["c.jpg"])
+    writer.close()
+    journal.close()
+    assert [row["path"] for row in read_rows(output)] == ["a.jpg", "b.jpg", "c.jpg"]
+
+
+def test_writer_refuses_to_truncate_past_its_end(tmp_path):
+    writer = JsonlWriter(str(tmp_path / "out.jsonl"))
+    position = writer.write([{"path": "a.jpg"}])
+    with pytest.raises(ValueError):
+        writer.truncate(position + 1)
+    writer.close()
+
+
+def test_open_writer_checks_the_extension(tmp_path):
+    open_writer(str(tmp_path / "out.ndjson"), 100).close()
+    with pytest.raises(ValueError):
+        open_writer(str(tmp_path / "out.csv"), 100)
+
+
+def test_find_images(tmp_path):
+    for name in ("b.JPG", "a.png", "notes.txt", ".hidden.jpg", "sub/c.jpeg", ".cache/d.jpg"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+    assert find_images(str(tmp_path)) == ["a.png", "b.JPG", "sub/c.jpeg"]
+    assert find_images(str(tmp_path), recursive=False) == ["a.png", "b.JPG"]
+
+
+def test_softmax():
+    probs = softmax(np.array([[0.0, 0.0], [1000.0, 0.0]]))
+    np.testing.assert_allclose(probs, [[0.5, 0.5], [1.0, 0.0]])
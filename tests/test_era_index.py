@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from era_index import EraIndex, format_year
+
+
+def test_lookup_matches_brute_force():
+    rng = np.random.default_rng(21)
+    for n in (0, 1, 5, 60):
+        starts = rng.integers(-5000, 2000, n)
+        eras = [{"name": f"era{i}", "start": int(s), "end": int(s + rng.integers(0, 800))}
+                for i, s in enumerate(starts)]
+        index = EraIndex(eras)
+        assert len(index) == n
+        years = [int(y) for y in rng.integers(-5500, 2500, 200)]
+        years += [era[side] for era in eras for side in ("start", "end")]
+        for year in years:
+            expected = [i for i, era in enumerate(index.eras) if era["start"] <= year <= era["end"]]
+            assert index.positions_at(year) == expected
+            assert index.eras_at(year) == [index.eras[i] for i in expected]
+            assert index.names_at(year) == [index.eras[i]["name"] for i in expected]
+
+
+def test_shared_boundary_belongs_to_both_eras():
+    index = EraIndex([
+        {"name": "Sangam", "start": -300, "end": 300},
+        {"name": "Pallava", "start": 300, "end": 900},
+    ])
+    assert index.names_at(300) == ["Sangam", "Pallava"]
+    assert index.names_at(301) == ["Pallava"]
+    assert index.names_at(1000) == []
+
+
+def test_rejects_era_ending_before_it_starts():
+    with pytest.raises(ValueError):
+        EraIndex([{"name": "backwards", "start": 10, "end": -10}])
+
+
+def test_format_year():
+    assert format_year(-3300) == "3300 BCE"
+    assert format_year(1526) == "1526 CE"
+    assert format_year(0) == "0 CE"
@@ -0,0 +1,45 @@
+import subprocess
+import time
+
+import pytest
+
+from pdf_jobs import ReportJobs, payload_key
+from prediction_cache import BoundedDiskStore
+
+
+def test_payload_key_covers_the_inputs():
+    payload = {"top1": {"class": "Pottery", "probability": 0.9}}
+    assert payload_key(payload) == payload_key(dict(reversed(payload.items())))
+    assert payload_key(payload, [{"site": "Keezhadi"}]) != payload_key(payload, [{"site": "Adichanallur"}])
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Two web workers sharing one report store; subprocess.check_output
+    # stands in for the report builder, returning b"" as the PDF
+    store = str(tmp_path / "reports")
+    jobs = [ReportJobs(subprocess.check_output, max_workers=1, disk=BoundedDiskStore(store)) for _ in range(2)]
+    yield jobs
+    for worker in jobs:
+        if worker._pool is not None:
+            worker._pool.shutdown()
+
+
+def test_other_workers_see_unfinished_and_failed_jobs(workers):
+    builder, other = workers
+    future = builder.submit("slow", ["sleep", "1"])
+    assert other.status("slow")["status"] == "running"
+    assert future.result(timeout=60) == b""
+    assert other.status("slow") == {"job_id": "slow", "status": "done"}
+    assert other.result("slow") == b""
+
+    with pytest.raises(subprocess.CalledProcessError):
+        builder.submit("broken", ["false"]).result(timeout=60)
+    assert other.status("broken")["status"] == "failed"
+    assert other.status("unknown") is None
+
+
+def test_lost_jobs_are_reported_as_failed(workers):
+    builder, other = workers
+    builder._share("lost", {"status": "running", "submitted_at": time.time() - other.build_timeout - 1})
+    assert other.status("lost") == {"job_id": "lost", "status": "failed", "error": "Report build did not finish"}
@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+
+from prediction_cache import BoundedDiskStore
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    def make(**kwargs):
+        store = BoundedDiskStore(str(tmp_path / "store"), **kwargs)
+        # Sweep by hand so the background thread cannot race the assertions
+        monkeypatch.setattr(store, "_ensure_sweeper", lambda: None)
+        return store
+    return make
+
+
+def age(store, key, seconds):
+    then = time.time() - seconds
+    os.utime(store._path(key), (then, then))
+
+
+def test_set_get_delete(make_store):
+    store = make_store()
+    assert store.get("a") is None
+    store.set("a", b"payload")
+    assert store.get("a") == b"payload"
+    store.delete("a")
+    assert store.get("a") is None
+    assert (store.hits, store.misses, store.writes) == (1, 2, 1)
+
+
+def test_sweep_drops_idle_entries(make_store):
+    store = make_store(max_age_seconds=60)
+    store.set("old", b"x")
+    store.set("new", b"y")
+    age(store, "old", 120)
+    store.sweep()
+    assert store.get("old") is None
+    assert store.get("new") == b"y"
+    assert store.evictions == 1
+
+
+def test_sweep_evicts_least_recently_used_until_under_max_bytes(make_store):
+    store = make_store(max_bytes=250)
+    for i, key in enumerate("abc"):
+        store.set(key, bytes(100))
+        age(store, key, 30 - 10 * i)
+    assert store.get("a") is not None  # the read makes "a" the most recent
+    store.sweep()
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    stats = store.stats()
+    assert (stats["files"], stats["bytes"], stats["evictions"]) == (2, 200, 1)
+
+
+def test_touch(make_store):
+    store = make_store(max_age_seconds=60)
+    assert not store.touch("a")
+    store.set("a", b"x")
+    age(store, "a", 120)
+    assert store.touch("a")
+    store.sweep()
+    assert store.get("a") == b"x"
@@ -0,0 +1,28 @@
+import os
+
+from provision_model import checkpoint_stat, file_sha256, same_checkpoint
+
+
+def test_same_checkpoint(tmp_path):
+    ckpt = tmp_path / "artifact_with_val.pth"
+    ckpt.write_bytes(b"weights")
+    recorded = {"checkpoint_sha256": file_sha256(str(ckpt)), "checkpoint_stat": checkpoint_stat(str(ckpt))}
+    assert same_checkpoint(recorded, str(ckpt))
+    assert same_checkpoint(recorded, str(ckpt), verify=True)
+
+    # A copy that lost the mtime is still recognised by its hash
+    os.utime(ckpt, ns=(1, 1))
+    assert same_checkpoint(recorded, str(ckpt))
+
+    ckpt.write_bytes(b"retrained")
+    assert not same_checkpoint(recorded, str(ckpt))
+    # Reports written before the checkpoint was recorded never match
+    assert not same_checkpoint({}, str(ckpt))
+
+
+def test_same_stat_is_trusted_unless_verifying(tmp_path):
+    ckpt = tmp_path / "artifact_with_val.pth"
+    ckpt.write_bytes(b"weights")
+    recorded = {"checkpoint_sha256": "0" * 64, "checkpoint_stat": checkpoint_stat(str(ckpt))}
+    assert same_checkpoint(recorded, str(ckpt))
+    assert not same_checkpoint(recorded, str(ckpt), verify=True)
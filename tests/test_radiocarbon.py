@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import radiocarbon
+from radiocarbon import CalibrationCurve, age_bp, date_batch, monte_carlo_ages
+
+
+def test_age_bp():
+    assert age_bp(100) == 0
+    assert age_bp(50) == pytest.approx(5730, abs=1)
+    np.testing.assert_allclose(age_bp([100, 25]), [0, 2 * age_bp(50)])
+
+
+def test_monte_carlo_without_error_is_exact():
+    mc = monte_carlo_ages([80.0, 10.0], 0.0, samples=100, seed=0)
+    np.testing.assert_allclose(mc["mean"], age_bp([80.0, 10.0]))
+    np.testing.assert_allclose(mc["low"], mc["high"])
+    np.testing.assert_array_equal(mc["clipped"], [0, 0])
+
+
+def test_monte_carlo_propagates_error():
+    mc = monte_carlo_ages([50.0], [0.5], samples=20000, seed=1)
+    # d(age)/d(percentage) = mean life / percentage
+    assert mc["sd"][0] == pytest.approx(radiocarbon.C14_MEAN_LIFE * 0.5 / 50, rel=0.05)
+    assert mc["low"][0] < age_bp(50) < mc["high"][0]
+
+
+def test_monte_carlo_is_independent_of_chunking(monkeypatch):
+    percentages = np.linspace(5, 95, 9)
+    whole = monte_carlo_ages(percentages, 1.0, samples=50, seed=7)
+    monkeypatch.setattr(radiocarbon, "CHUNK_ELEMENTS", 100)
+    chunked = monte_carlo_ages(percentages, 1.0, samples=50, seed=7)
+    for name in whole:
+        np.testing.assert_allclose(chunked[name], whole[name])
+
+
+def test_date_batch_reports_clipped_draws():
+    near_zero, plenty = date_batch([radiocarbon.MIN_PERCENTAGE, 60.0], [5.0, 1.0], samples=4000, seed=2)
+    assert near_zero["clipped_fraction"] == pytest.approx(0.5, abs=0.05)
+    assert plenty["clipped_fraction"] == 0
+    assert plenty["calendar_year"] == 1950 - plenty["age_bp"]
+    low, high = plenty["age_bp_interval"]
+    assert plenty["calendar_year_interval"] == [1950 - high, 1950 - low]
+
+
+def test_date_batch_is_reproducible_with_a_seed():
+    assert date_batch([40.0], [2.0], seed=3) == date_batch([40.0], [2.0], seed=3)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"percentages": []},
+    {"percentages": [[50.0]]},
+    {"percentages": ["fifty"]},
+    {"percentages": [0.0]},
+    {"percentages": [0.00001]},
+    {"percentages": [100.5]},
+    {"percentages": [50.0, 60.0], "sds": [1.0, 2.0, 3.0]},
+    {"percentages": [50.0], "sds": [-1.0]},
+    {"percentages": [50.0], "interval": 1.0},
+    {"percentages": [50.0], "seed": True},
+    {"percentages": [50.0], "seed": -1},
+])
+def test_date_batch_rejects_invalid_input(kwargs):
+    with pytest.raises(ValueError):
+        date_batch(**kwargs)
+
+
+def test_calibration_against_identity_curve(tmp_path):
+    path = tmp_path / "curve.14c"
+    years = np.arange(0, 10001, 5)
+    np.savetxt(path, np.column_stack((years, years, np.full(len(years), 10))), delimiter=',',
+               header="cal BP, 14C age, sigma")
+    curve = CalibrationCurve.load(str(path))
+
+    calibrated = curve.calibrate([2000.0, 50000.0], [30.0, 30.0])
+    assert calibrated["mean"][0] == pytest.approx(2000, abs=5)
+    assert calibrated["low"][0] < 2000 < calibrated["high"][0]
+    assert np.isnan(calibrated["mean"][1])
+
+    inside, outside = date_batch([80.0, 0.5], [0.0, 0.0], curve=curve, seed=0)
+    assert inside["calibrated"]["calendar_year_mean"] == pytest.approx(inside["calendar_year"], abs=5)
+    assert outside["calibrated"] is None
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from site_index import EARTH_RADIUS_KM, SiteIndex
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def random_sites(rng, n, clustered):
+    if clustered:
+        # Tamil Nadu-sized cluster, where the grid shrinks to small cells
+        return rng.uniform(8, 13, n), rng.uniform(76, 80, n)
+    # Uniform on the sphere, including the poles and the antimeridian
+    return np.degrees(np.arcsin(rng.uniform(-1, 1, n))), rng.uniform(-180, 180, n)
+
+
+@pytest.mark.parametrize("clustered", [False, True])
+def test_query_matches_brute_force(clustered):
+    rng = np.random.default_rng(18)
+    lat, lon = random_sites(rng, 2000, clustered)
+    index = SiteIndex(lat, lon)
+    for q_lat, q_lon in zip(*random_sites(rng, 40, clustered)):
+        expected = haversine_km(q_lat, q_lon, lat, lon)
+        order = np.argsort(expected)
+
+        for k in (1, 5, 50):
+            idx, dist = index.query(q_lat, q_lon, k=k)
+            np.testing.assert_array_equal(idx, order[:k])
+            np.testing.assert_allclose(dist, expected[order[:k]], atol=1e-6)
+
+        for radius_km in (25.0, 300.0):
+            idx, dist = index.query(q_lat, q_lon, radius_km=radius_km)
+            inside = order[expected[order] <= radius_km]
+            np.testing.assert_array_equal(idx, inside)
+            assert np.all(np.diff(dist) >= 0)
+
+            idx, _ = index.query(q_lat, q_lon, k=3, radius_km=radius_km)
+            np.testing.assert_array_equal(idx, inside[:3])
+
+
+def test_query_without_limits_returns_every_site():
+    index = SiteIndex([0.0, 10.0, 20.0], [0.0, 0.0, 0.0])
+    idx, dist = index.query(19.0, 0.0)
+    np.testing.assert_array_equal(idx, [2, 1, 0])
+    np.testing.assert_allclose(dist, haversine_km(19.0, 0.0, np.array([20.0, 10.0, 0.0]), 0.0))
+
+
+def test_empty_index():
+    idx, dist = SiteIndex([], []).query(9.45, 77.55, k=5)
+    assert len(idx) == 0 and len(dist) == 0